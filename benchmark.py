@@ -0,0 +1,416 @@
+import argparse
+import contextlib
+import os
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+from scrapli.driver.core import IOSXEDriver, NXOSDriver
+
+import data_collector
+import parsers
+import switchdb
+
+XE_VERSION = """Cisco IOS XE Software, Version 17.03.04
+Cisco IOS Software [Amsterdam], Catalyst L3 Switch Software (CAT9K_IOSXE), \
+Version 17.3.4, RELEASE SOFTWARE (fc3)
+Technical Support: http://www.cisco.com/techsupport
+ROM: IOS-XE ROMMON
+{name} uptime is 1 week, 2 days
+cisco C9300-48P (X86) processor with 1419044K/6147K bytes of memory.
+Processor board ID {serial}
+System Serial Number               : {serial}
+"""
+
+NX_VERSION = """Cisco Nexus Operating System (NX-OS) Software
+Software
+  BIOS: version 07.69
+  NXOS: version 9.3(8)
+Hardware
+  cisco Nexus9000 C93180YC-EX chassis
+  Intel(R) Xeon(R) CPU  @ 1.80GHz with 24571632 kB of memory.
+  Processor Board ID {serial}
+"""
+
+XE_INTERFACE = """GigabitEthernet1/0/{port} is {status}, line protocol is {protocol}
+  Hardware is Gigabit Ethernet, address is 00aa.bb{device:02x}.{port:04x} \
+(bia 00aa.bb{device:02x}.{port:04x})
+  Description: bench port {port}
+  MTU 1500 bytes, BW 1000000 Kbit/sec, DLY 10 usec,
+  {duplex}, {speed}, media type is 10/100/1000BaseTX
+"""
+
+NX_INTERFACE = """Ethernet1/{port} is {status}
+admin state is {admin}, Dedicated Interface
+  Hardware: 100/1000/10000 Ethernet, address: 00aa.bb{device:02x}.{port:04x} \
+(bia 00aa.bb{device:02x}.{port:04x})
+  Description: bench port {port}
+  MTU 1500 bytes, BW 10000000 Kbit, DLY 10 usec
+  {duplex}, {speed}, media type is 10G
+"""
+
+XE_STATUS_HEADER = (
+    "Port         Name               Status       Vlan       Duplex  Speed Type"
+)
+XE_DESCRIPTION_HEADER = (
+    "Interface                      Status         Protocol Description"
+)
+NX_STATUS_HEADER = (
+    "Port          Name               Status    Vlan      Duplex  Speed   Type"
+)
+NX_DESCRIPTION_HEADER = "Port          Type   Speed   Description"
+
+
+def buildInterfacesXE(device, ports):
+    """
+    Generate IOS-XE 'show interfaces' output with a mix of
+    connected, not connected & disabled ports
+    """
+    output = []
+    for port in range(1, ports + 1):
+        if port % 5 == 0:
+            status, protocol = "administratively down", "down"
+        elif port % 2:
+            status, protocol = "up", "up"
+        else:
+            status, protocol = "down", "down"
+        up = protocol == "up"
+        output.append(
+            XE_INTERFACE.format(
+                port=port,
+                device=device % 256,
+                status=status,
+                protocol=protocol,
+                duplex="Full-duplex" if up else "Auto-duplex",
+                speed="1000Mb/s" if up else "Auto-speed",
+            )
+        )
+    return "".join(output)
+
+
+def buildInterfacesNX(device, ports):
+    """
+    Generate NX-OS 'show interface' output with a mix of
+    connected, not connected & disabled ports
+    """
+    output = []
+    for port in range(1, ports + 1):
+        if port % 5 == 0:
+            status, admin = "down (Administratively down)", "down"
+        elif port % 2:
+            status, admin = "up", "up"
+        else:
+            status, admin = "down (Link not connected)", "up"
+        up = status == "up"
+        output.append(
+            NX_INTERFACE.format(
+                port=port,
+                device=device % 256,
+                status=status,
+                admin=admin,
+                duplex="full-duplex" if up else "auto-duplex",
+                speed="10 Gb/s" if up else "auto-speed",
+            )
+        )
+    return "".join(output)
+
+
+def portState(port):
+    """
+    Status of a simulated port: connected, not connected or disabled
+    """
+    if port % 5 == 0:
+        return "disabled"
+    return "connected" if port % 2 else "notconnect"
+
+
+def buildLeanXE(device, ports):
+    """
+    Generate IOS-XE 'show interfaces status' & 'show interfaces description'
+    output for the same ports as buildInterfacesXE
+    """
+    status = [XE_STATUS_HEADER]
+    description = [XE_DESCRIPTION_HEADER]
+    for port in range(1, ports + 1):
+        state = portState(port)
+        name = f"Gi1/0/{port}"
+        up = state == "connected"
+        duplex, speed = ("a-full", "a-1000") if up else ("auto", "auto")
+        status.append(
+            f"{name:<13}{'bench port ' + str(port):<19}{state:<13}{'1':<11}"
+            f"{duplex:>6} {speed:>6} 10/100/1000BaseTX"
+        )
+        admin = {"connected": "up", "notconnect": "down"}.get(state, "admin down")
+        protocol = "up" if up else "down"
+        description.append(f"{name:<31}{admin:<15}{protocol:<9}bench port {port}")
+    return "\n".join(status) + "\n", "\n".join(description) + "\n"
+
+
+def buildLeanNX(device, ports):
+    """
+    Generate NX-OS 'show interface status' & 'show interface description'
+    output for the same ports as buildInterfacesNX
+    """
+    rule = "-" * 80
+    status = [rule, NX_STATUS_HEADER, rule]
+    description = [rule, NX_DESCRIPTION_HEADER, rule]
+    for port in range(1, ports + 1):
+        state = portState(port)[:9]
+        name = f"Eth1/{port}"
+        duplex, speed = ("full", "10G") if state == "connected" else ("auto", "auto")
+        status.append(
+            f"{name:<14}{'bench port ' + str(port):<19}{state:<10}{'1':<10}"
+            f"{duplex:<8}{speed:<8}10Gbase-SR"
+        )
+        description.append(f"{name:<14}{'eth':<7}{'10G':<8}bench port {port}")
+    return "\n".join(status) + "\n", "\n".join(description) + "\n"
+
+
+def readCapture(path):
+    """
+    Read a file of captured CLI output, or return None if not given
+    """
+    if not path:
+        return None
+    with open(path, "r") as capture:
+        return capture.read()
+
+
+def captureSerial(platform, version):
+    """
+    Find the serial number in captured 'show version' output
+    """
+    parsed = parsers.parseOutput(platform, "show version", version)
+    return data_collector.PLATFORMS[platform][3](parsed).serial
+
+
+def buildDevices(args):
+    """
+    Build a device inventory & the CLI output each device will return.
+    Captured output can only be replayed to a single platform
+    """
+    devicelist = {}
+    outputs = {}
+    captured = readCapture(args.interfaces)
+    capturedversion = readCapture(args.version)
+    if capturedversion:
+        # Give each device its own serial, as switches are stored by serial
+        capturedserial = captureSerial(
+            data_collector.DEVICE_TYPES[args.platform], capturedversion
+        )
+    for index in range(args.devices):
+        name = f"bench-{index:05d}"
+        address = f"198.18.{index // 256}.{index % 256}"
+        nxos = args.platform == "nx-os" or (args.platform == "mixed" and index % 2)
+        serial = f"BENCH{index:07d}"
+        if capturedversion:
+            version = capturedversion.replace(capturedserial, serial)
+        elif nxos:
+            version = NX_VERSION.format(serial=serial)
+        else:
+            version = XE_VERSION.format(name=name, serial=serial)
+        if nxos:
+            interfaces = captured or buildInterfacesNX(index, args.ports)
+            status, description = buildLeanNX(index, args.ports)
+        else:
+            interfaces = captured or buildInterfacesXE(index, args.ports)
+            status, description = buildLeanXE(index, args.ports)
+        devicelist[name] = {
+            "address": address,
+            "username": "bench",
+            "password": "bench",
+            "type": "nx-os" if nxos else "ios-xe",
+        }
+        outputs[address] = {
+            "version": version,
+            "interfaces": interfaces,
+            "status": status,
+            "description": description,
+        }
+    return devicelist, outputs
+
+
+@contextlib.contextmanager
+def stubDrivers(outputs, connect_latency, command_latency):
+    """
+    Replace the scrapli transport with canned output, so the
+    collector runs unchanged without any real devices.
+    Latencies are in seconds & simulate network round trips
+    """
+    methods = ("open", "send_command", "close", "isalive")
+    saved = {
+        driver: {method: getattr(driver, method) for method in methods}
+        for driver in (IOSXEDriver, NXOSDriver)
+    }
+
+    def open(self):
+        time.sleep(connect_latency)
+
+    def send_command(self, command, **kwargs):
+        time.sleep(command_latency)
+        if command.endswith("| json"):
+            # Make the collector fall back to text output
+            return SimpleNamespace(result="% Invalid command")
+        for output in ("version", "status", "description"):
+            if output in command:
+                return SimpleNamespace(result=outputs[self.host][output])
+        return SimpleNamespace(result=outputs[self.host]["interfaces"])
+
+    def close(self):
+        pass
+
+    def isalive(self):
+        return True
+
+    stubs = {
+        "open": open,
+        "send_command": send_command,
+        "close": close,
+        "isalive": isalive,
+    }
+    for driver in saved:
+        for method, stub in stubs.items():
+            setattr(driver, method, stub)
+    try:
+        yield
+    finally:
+        for driver, originals in saved.items():
+            for method, original in originals.items():
+                setattr(driver, method, original)
+
+
+@contextlib.contextmanager
+def silenced():
+    """
+    Discard collector output, including output from the parse
+    worker processes, which write straight to file descriptor 1
+    """
+    sys.stdout.flush()
+    saved = os.dup(1)
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+    try:
+        yield
+    finally:
+        sys.stdout.flush()
+        os.dup2(saved, 1)
+        os.close(saved)
+        os.close(devnull)
+
+
+def percentile(values, pct):
+    """
+    Nearest-rank percentile of a list of values
+    """
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def report(number, elapsed, results, devices):
+    """
+    Print end-to-end & per-stage timings for one sweep
+    """
+    print(
+        f"Sweep {number}: {elapsed:.3f}s, {len(results)}/{devices} devices, "
+        f"{len(results) / elapsed:.1f} devices/s"
+    )
+    print(f"  {'stage':<8} {'total':>10} {'mean':>10} {'p95':>10} {'max':>10}")
+    for stage in switchdb.TIMING_STAGES:
+        values = [result.timings.get(stage, 0) for result in results]
+        if not values:
+            continue
+        print(
+            f"  {stage:<8} {sum(values):>9.3f}s {sum(values) / len(values):>9.4f}s "
+            f"{percentile(values, 95):>9.4f}s {max(values):>9.4f}s"
+        )
+
+
+def main():
+    """
+    Run timed collector sweeps against simulated devices
+    """
+    parser = argparse.ArgumentParser(
+        description="Benchmark the data collector against simulated devices"
+    )
+    parser.add_argument("--devices", type=int, default=100)
+    parser.add_argument("--ports", type=int, default=48, help="ports per device")
+    parser.add_argument(
+        "--platform", choices=("ios-xe", "nx-os", "mixed"), default="mixed"
+    )
+    parser.add_argument(
+        "--connect-latency", type=float, default=0.2, help="seconds per connect"
+    )
+    parser.add_argument(
+        "--command-latency", type=float, default=0.05, help="seconds per command"
+    )
+    parser.add_argument("--sweeps", type=int, default=3)
+    parser.add_argument("--workers", type=int, help="override max_workers")
+    parser.add_argument(
+        "--parse-workers", type=int, help="override parse_workers (0 = in-thread)"
+    )
+    parser.add_argument("--parser", choices=("builtin", "genie"), default="builtin")
+    parser.add_argument(
+        "--profile",
+        choices=("full", "lean"),
+        default="full",
+        help="collection profile, lean polls skip the full 'show interfaces'",
+    )
+    parser.add_argument(
+        "--persistent", action="store_true", help="keep sessions open between sweeps"
+    )
+    parser.add_argument(
+        "--interfaces", help="replay a captured 'show interfaces' output file"
+    )
+    parser.add_argument(
+        "--version", help="replay a captured 'show version' output file"
+    )
+    parser.add_argument(
+        "--verbose", action="store_true", help="show collector output"
+    )
+    args = parser.parse_args()
+    if (args.interfaces or args.version) and args.platform == "mixed":
+        parser.error("replaying captured output needs --platform ios-xe or nx-os")
+
+    settings = dict(data_collector.DEFAULT_SETTINGS)
+    settings["parser"] = args.parser
+    settings["persistent_sessions"] = args.persistent
+    settings["collect_profile"] = args.profile
+    # Simulated devices have no real SSH port to probe
+    settings["precheck"] = False
+    if args.workers:
+        settings["max_workers"] = args.workers
+    if args.parse_workers is not None:
+        settings["parse_workers"] = args.parse_workers
+    devicelist, outputs = buildDevices(args)
+    print(
+        f"Benchmarking {args.devices} {args.platform} devices x {args.ports} ports, "
+        f"{settings['max_workers']} workers, connect {args.connect_latency}s, "
+        f"command {args.command_latency}s"
+    )
+    # Keep the DB & raw output away from the real ones
+    workdir = tempfile.TemporaryDirectory()
+    cwd = os.getcwd()
+    os.chdir(workdir.name)
+    switchdb.DB_PATH = os.path.join(workdir.name, "sw-util.db")
+    try:
+        with stubDrivers(outputs, args.connect_latency, args.command_latency):
+            for number in range(1, args.sweeps + 1):
+                output = contextlib.nullcontext() if args.verbose else silenced()
+                start = time.perf_counter()
+                with output:
+                    results = data_collector.sweep(devicelist, settings)
+                report(number, time.perf_counter() - start, results, args.devices)
+    finally:
+        sessions = data_collector.getSessionPool(settings)
+        if sessions:
+            sessions.closeAll()
+        switchdb.getDB().close()
+        os.chdir(cwd)
+        workdir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+# Registry of the port counters kept for each switch.
+# Everything else - record fields, DB columns, port history & the
+# dashboard pages - is built from these tables, so a new speed or
+# media type only needs a new row here. Missing DB columns are
+# added automatically when the DB is opened
+
+# Port state counters
+STATE_COLUMNS = ("total_port", "up_port", "down_port", "disabled_port")
+
+# Operational speeds of connected ports: column, label & bandwidth in Kbit/s
+SPEED_BUCKETS = (
+    ("intop10m", "10M", 10_000),
+    ("intop100m", "100M", 100_000),
+    ("intop1g", "1G", 1_000_000),
+    ("intop2_5g", "2.5G", 2_500_000),
+    ("intop5g", "5G", 5_000_000),
+    ("intop10g", "10G", 10_000_000),
+    ("intop25g", "25G", 25_000_000),
+    ("intop40g", "40G", 40_000_000),
+    ("intop50g", "50G", 50_000_000),
+    ("intop100g", "100G", 100_000_000),
+    ("intop400g", "400G", 400_000_000),
+)
+# Connected ports running at any other speed
+OTHER_SPEED = ("intopother", "Other")
+
+# Port media: column, label & (lowercase) substrings of the reported
+# media type. The first match wins, anything unmatched or without
+# a media type is counted in the last bucket.
+# NX-OS 'show interface' only reports a speed class (e.g. 1G) as the
+# media type, so 'show interface status' types like 1000base-T
+# mustn't count as copper either, or lean & full polls would disagree
+MEDIA_BUCKETS = (
+    ("intmedcop", "Copper", ("basetx",)),
+    ("intmedvirt", "Virtual", ("virtual",)),
+    ("intmedsfp", "SFP-based", ()),
+)
+
+# Every counter, in record & DB column order
+SPEED_LABELS = tuple((column, label) for column, label, _ in SPEED_BUCKETS) + (
+    OTHER_SPEED,
+)
+MEDIA_LABELS = tuple((column, label) for column, label, _ in MEDIA_BUCKETS)
+COUNTER_COLUMNS = (
+    STATE_COLUMNS
+    + tuple(column for column, _ in SPEED_LABELS)
+    + tuple(column for column, _ in MEDIA_LABELS)
+)
+
+_speeds = {bandwidth: column for column, label, bandwidth in SPEED_BUCKETS}
+
+
+def speedColumn(bandwidth):
+    """
+    Counter for a connected port's bandwidth, in Kbit/s
+    """
+    return _speeds.get(bandwidth, OTHER_SPEED[0])
+
+
+def mediaColumn(media):
+    """
+    Counter for a port's media type, which may be None
+    """
+    if media:
+        media = media.lower()
+        for column, label, patterns in MEDIA_BUCKETS:
+            if any(pattern in media for pattern in patterns):
+                return column
+    return MEDIA_BUCKETS[-1][0]
@@ -1,20 +1,230 @@
+import argparse
+import hashlib
+import heapq
+import multiprocessing
 import os
+import random
+import signal
+import socket
+import threading
+import time
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+from concurrent.futures.process import BrokenProcessPool
 
 import yaml
 from scrapli.driver.core import IOSXEDriver, NXOSDriver
 
+import buckets
+import parsers
+import rawstore
 import switchdb
+from records import Interface, PortCounts, SystemInfo
 
 
+# Collector settings used when not overridden in config.yml
+DEFAULT_SETTINGS = {
+    "max_workers": 10,
+    "device_timeout": 120,
+    "parser": "builtin",
+    "nxos_json": False,
+    "history_raw_hours": 48,
+    "history_hourly_days": 90,
+    "history_daily_days": 730,
+    "raw_codec": "gzip",
+    "raw_keep": 10,
+    "persistent_sessions": False,
+    "max_sessions": 200,
+    "session_idle_timeout": 900,
+    "poll_interval": 300,
+    "max_backoff": 3600,
+    "jitter": 0.1,
+    "publish_interval": 60,
+    "precheck": True,
+    "precheck_timeout": 1,
+    "precheck_workers": 100,
+    "parse_workers": None,
+    "parse_backlog": 100,
+    "collect_profile": "full",
+    "full_interval": 3600,
+}
+
+# Sessions kept open across polling cycles, see getSessionPool()
+_sessions = None
+# Last parse of config.yml, along with the file's mtime
+_config = None
+# Use the much faster C YAML loader when it's available
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+
+class PollResult:
+    """
+    Everything collected from one device during a single poll.
+    Passed explicitly between collection stages, so that
+    many devices can be polled at the same time
+    """
+
+    def __init__(self, name, ip):
+        self.name = name
+        self.ip = ip
+        self.platform = None
+        # (command sent, raw output) for show version & show interfaces
+        self.version_output = None
+        self.interface_output = None
+        # Raw output of the lean status & description commands, if used instead
+        self.lean_output = None
+        self.sysinfo = None
+        self.portinfo = None
+        self.detailedinfo = None
+        self.raw_output = None
+        self.changes = 0
+        # When collection from the device started
+        self.polled_at = time.time()
+        # Seconds spent in each collection stage
+        self.timings = {}
+
+
+class SessionPool:
+    """
+    Keeps SSH sessions open between polling cycles, so that repeat
+    polls of a device skip the TCP handshake, key exchange & auth.
+    Each session is checked out by one worker at a time
+    """
+
+    def __init__(self, max_open, idle_timeout):
+        self.max_open = max_open
+        self.idle_timeout = idle_timeout
+        # Idle sessions by device address, with the time they were released
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def acquire(self, deviceconfig):
+        """
+        Check out a healthy cached session for the device,
+        or open a new one. Returns the session & whether it was reused
+        """
+        with self.lock:
+            entry = self.sessions.pop(deviceconfig["address"], None)
+        if entry:
+            conn, released = entry
+            if time.monotonic() - released < self.idle_timeout and conn.isalive():
+                print(f"Reusing session to {deviceconfig['address']}")
+                return conn, True
+            self.discard(conn)
+        return connectToDevice(deviceconfig), False
+
+    def release(self, deviceconfig, conn):
+        """
+        Return a session to the pool after a successful poll.
+        The least recently used sessions are closed to stay under max_open
+        """
+        evicted = []
+        with self.lock:
+            self.sessions[deviceconfig["address"]] = (conn, time.monotonic())
+            while len(self.sessions) > self.max_open:
+                oldest = min(self.sessions, key=lambda k: self.sessions[k][1])
+                evicted.append(self.sessions.pop(oldest)[0])
+        for conn in evicted:
+            self.discard(conn)
+
+    def discard(self, conn):
+        """
+        Close a session which won't be reused
+        """
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def expire(self):
+        """
+        Close any sessions which have sat idle for too long
+        """
+        now = time.monotonic()
+        with self.lock:
+            expired = [
+                address
+                for address, (conn, released) in self.sessions.items()
+                if now - released >= self.idle_timeout
+            ]
+            conns = [self.sessions.pop(address)[0] for address in expired]
+        for conn in conns:
+            self.discard(conn)
+
+    def closeAll(self):
+        """
+        Close every idle session
+        """
+        with self.lock:
+            conns = [conn for conn, released in self.sessions.values()]
+            self.sessions.clear()
+        for conn in conns:
+            self.discard(conn)
+
+
+def getSessionPool(settings):
+    """
+    Return the process-wide session pool, creating it on first use.
+    Returns None when persistent sessions are disabled
+    """
+    global _sessions
+    if not settings["persistent_sessions"]:
+        return None
+    if _sessions is None:
+        _sessions = SessionPool(
+            settings["max_sessions"], settings["session_idle_timeout"]
+        )
+    return _sessions
+
+
+def loadConfig():
+    """
+    Parse config.yml, reusing the previous parse
+    if the file hasn't been modified since
+    """
+    global _config
+    mtime = os.stat("config.yml").st_mtime_ns
+    if _config is None or _config[0] != mtime:
+        with open("config.yml", "rb") as config:
+            _config = (mtime, yaml.load(config, Loader=YAML_LOADER))
+    return _config[1]
+
+
+def loadSettings():
+    """
+    Load collector settings from config.yml,
+    falling back to defaults for anything not set
+    """
+    settings = dict(DEFAULT_SETTINGS)
+    settings.update(loadConfig().get("Settings") or {})
+    return settings
+
 
 def loadDevices():
     """
     Load device inventory from config.yml
     """
     print("Loading devices from config file...")
-    with open("config.yml", "r") as config:
-        devicelist = yaml.full_load(config)
-    return devicelist["Devices"]
+    return loadConfig()["Devices"]
+
+
+def loadGroups():
+    """
+    Load device group settings from config.yml
+    """
+    return loadConfig().get("Groups") or {}
+
+
+def addTiming(timings, stage, start):
+    """
+    Add the time since start to a collection stage
+    """
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0) + time.perf_counter() - start
 
 
 def connectToDevice(deviceconfig):
@@ -48,38 +258,35 @@ def connectToDevice(deviceconfig):
     return conn
 
 
-def getInterfaceInfo(device):
-    """
-    Issue 'Show Interfaces' command to device
-    Process data & populate dict with interface status
-    """
-    # Send command to device
-    if type(device) == IOSXEDriver:
-        resp = device.send_command("show interfaces")
-    if type(device) == NXOSDriver:
-        resp = device.send_command("show interface")
-    # Save a copy of the raw output
-    save_raw_output(resp)
-    # Parse raw CLI using Genie
-    intdata = resp.genie_parse_output()
-    interfaceStats = {
-        "total_port": 0,
-        "up_port": 0,
-        "down_port": 0,
-        "disabled_port": 0,
-        "intop10m": 0,
-        "intop100m": 0,
-        "intop1g": 0,
-        "intop10g": 0,
-        "intop25g": 0,
-        "intop40g": 0,
-        "intop100g": 0,
-        "intmedcop": 0,
-        "intmedsfp": 0,
-        "intmedvirtual": 0,
-    }
-    # Init dict for detailed interface operational stat collection
-    intDetailed = {}
+def runCommand(device, platform, command, settings=DEFAULT_SETTINGS, timings=None):
+    """
+    Send a command to the device.
+    NX-OS devices are asked for structured JSON output when
+    enabled, falling back to text if it isn't supported.
+    Returns the command which produced the output & the raw output
+    """
+    if platform == "nxos" and settings["nxos_json"]:
+        start = time.perf_counter()
+        resp = device.send_command(f"{command} | json")
+        addTiming(timings, "command", start)
+        if parsers.hasJSON(resp.result):
+            return f"{command} | json", resp.result
+        print(f"No JSON output for '{command}', falling back to text")
+    start = time.perf_counter()
+    resp = device.send_command(command)
+    addTiming(timings, "command", start)
+    return command, resp.result
+
+
+def tallyInterfaces(intdata):
+    """
+    Populate port counts & per-interface detail
+    from parsed 'show interfaces' data.
+    Speed & media counters come from the registry in buckets.py
+    """
+    interfaceStats = dict.fromkeys(PortCounts._fields, 0)
+    # Init list for detailed interface operational stat collection
+    intDetailed = []
     # Process each interface
     for iface in intdata:
         # Skip VLAN / PortChannel Interfaces
@@ -90,158 +297,275 @@ def getInterfaceInfo(device):
             print(f"found management interface: {iface}")
             continue
         print(f"Working on interface {iface}")
+        data = intdata[iface]
         # Collect detailed interface stats (name, oper status, description, MAC)
-        intDetailed[iface] = {}
-        intDetailed[iface]["oper_status"] = intdata[iface]["oper_status"]
-        try:
-            intDetailed[iface]["description"] = intdata[iface]["description"]
-        except:
-            intDetailed[iface]["description"] = "N/A"
-        intDetailed[iface]["phys_addr"] = intdata[iface]["phys_address"]
-        intDetailed[iface]["oper_speed"] = intdata[iface]["port_speed"]
-        intDetailed[iface]["oper_duplex"] = intdata[iface]["duplex_mode"]
+        intDetailed.append(
+            Interface(
+                iface,
+                data["oper_status"],
+                data.get("description", "N/A"),
+                # None from lean polls, filled in from the DB by keepAddresses()
+                data.get("phys_address", "N/A"),
+                data["port_speed"],
+                data["duplex_mode"],
+            )
+        )
         # Count all Ethernet interfaces
         interfaceStats["total_port"] += 1
         # Count admin-down interfaces
-        if not intdata[iface]["enabled"]:
+        if not data["enabled"]:
             interfaceStats["disabled_port"] += 1
         # Count 'not connected' interfaces
-        elif intdata[iface]["enabled"] and intdata[iface]["oper_status"] == "down":
+        elif data["oper_status"] == "down":
             interfaceStats["down_port"] += 1
         # Count up / connected interfaces - Then collect current speeds
-        elif intdata[iface]["enabled"] and intdata[iface]["oper_status"] == "up":
+        elif data["oper_status"] == "up":
             interfaceStats["up_port"] += 1
-            speed = intdata[iface]["bandwidth"]
-            if speed == 10_000:
-                interfaceStats["intop10m"] += 1
-            if speed == 100_000:
-                interfaceStats["intop100m"] += 1
-            if speed == 1_000_000:
-                interfaceStats["intop1g"] += 1
-            if speed == 10_000_000:
-                interfaceStats["intop10g"] += 1
-            if speed == 25_000_000:
-                interfaceStats["intop25g"] += 1
-            if speed == 40_000_000:
-                interfaceStats["intop40g"] += 1
-            if speed == 100_000_000:
-                interfaceStats["intop100g"] += 1
+            interfaceStats[buckets.speedColumn(data.get("bandwidth"))] += 1
         # Count number of interfaces by media type
-        try:
-            media = intdata[iface]["media_type"]
-            if "1000BaseTX" in media:
-                interfaceStats["intmedcop"] += 1
-            elif "Virtual" in media:
-                interfaceStats["intmedvirtual"] += 1
-            else:
-                interfaceStats["intmedsfp"] += 1
-        except KeyError:
-            interfaceStats["intmedsfp"] += 1
+        interfaceStats[buckets.mediaColumn(data.get("media_type"))] += 1
     # When complete - return int stats list
-    return interfaceStats, intDetailed
+    return PortCounts(**interfaceStats), intDetailed
+
+
+def load_raw_output(serial):
+    """
+    Read back the latest raw CLI output stored by save_raw_output().
+    Returns None if nothing has been stored for the serial
+    """
+    return rawstore.load(switchdb.getDB(), serial)
 
 
-def save_raw_output(data):
+def save_raw_output(serial, data, settings=DEFAULT_SETTINGS):
     """
-    Creates a local working directory where all raw CLI
-    output is stored.
+    Archive raw CLI output, compressed & keeping the
+    last few distinct captures per switch
     """
-    # Create local directory to store raw output
-    if not os.path.exists("raw_output"):
-        os.makedirs("raw_output")
-    # Dump port information to file
-    with open(f"raw_output/{system_serial}.txt", "w") as a:
-        a.write(data.result)
+    rawstore.save(
+        switchdb.getDB(), serial, data, settings["raw_codec"], settings["raw_keep"]
+    )
 
 
-def getSystemInfoXE(device):
+def getSystemInfoXE(parsed):
     """
      -- FOR IOS-XE DEVICES --
-    Issue 'Show Version' command to device
-    Return serial number, model, current software version
+    Pick serial number, model & current software version
+    out of parsed 'Show Version' output
     """
-    resp = device.send_command("show version")
-    parsed = resp.genie_parse_output()
-    sysinfo = {}
-    sysinfo["serial"] = parsed["version"]["chassis_sn"]
-    sysinfo["model"] = parsed["version"]["chassis"]
-    sysinfo["sw_ver"] = parsed["version"]["version"]
-    global system_serial
-    system_serial = sysinfo["serial"]
-    return sysinfo
+    return SystemInfo(
+        serial=parsed["version"]["chassis_sn"],
+        model=parsed["version"]["chassis"],
+        sw_ver=parsed["version"]["version"],
+    )
 
 
-def getSystemInfoNX(device):
+def getSystemInfoNX(parsed):
     """
      -- FOR NX-OS DEVICES --
-    Issue 'Show Version' command to device
-    Return serial number, model, current software version
+    Pick serial number, model & current software version
+    out of parsed 'Show Version' output
     """
-    resp = device.send_command("show version")
-    parsed = resp.genie_parse_output()
-    sysinfo = {}
-    sysinfo["serial"] = parsed["platform"]["hardware"]["processor_board_id"]
-    sysinfo["model"] = parsed["platform"]["hardware"]["model"]
-    sysinfo["sw_ver"] = parsed["platform"]["software"]["system_version"]
-    global system_serial
-    system_serial = sysinfo["serial"]
-    return sysinfo
+    return SystemInfo(
+        serial=parsed["platform"]["hardware"]["processor_board_id"],
+        model=parsed["platform"]["hardware"]["model"],
+        sw_ver=parsed["platform"]["software"]["system_version"],
+    )
+
+
+# Platform name for each device type in config.yml
+DEVICE_TYPES = {"ios-xe": "iosxe", "nx-os": "nxos"}
+# Per platform: the scrapli driver, commands sent & system info parser
+PLATFORMS = {
+    "iosxe": (IOSXEDriver, "show version", "show interfaces", getSystemInfoXE),
+    "nxos": (NXOSDriver, "show version", "show interface", getSystemInfoNX),
+}
+# Per platform: cheaper commands covering everything the dashboard
+# uses from 'show interfaces', except MAC addresses
+LEAN_COMMANDS = {
+    "iosxe": ("show interfaces status", "show interfaces description"),
+    "nxos": ("show interface status", "show interface description"),
+}
+
+
+def parseDevice(platform, version, interfaces, parser="builtin", lean=None):
+    """
+    Parse the raw 'show version' & 'show interfaces' output
+    collected from one device, or the lean command output if given.
+    Runs in the parse process pool, so only takes & returns picklable values.
+    Returns system info, port counts, interface details
+    & the seconds spent parsing
+    """
+    start = time.perf_counter()
+    command, output = version
+    parsed = parsers.parseOutput(platform, command, output, parser)
+    sysinfo = PLATFORMS[platform][3](parsed)
+    if lean:
+        intdata = parsers.parseInterfacesLean(platform, *lean)
+        portinfo, detailedinfo = tallyInterfaces(intdata)
+    else:
+        portinfo, detailedinfo = parseInterfaces(platform, interfaces, parser)
+    return sysinfo, portinfo, detailedinfo, time.perf_counter() - start
+
+
+def parseInterfaces(platform, interfaces, parser="builtin"):
+    """
+    Parse raw 'show interfaces' output, given as (command sent, output).
+    Returns port counts & interface details
+    """
+    command, output = interfaces
+    parsed = parsers.parseOutput(platform, command, output, parser)
+    return tallyInterfaces(parsed)
+
+
+def addParsed(result, parsed):
+    """
+    Store the output of parseDevice() in a poll result
+    """
+    result.sysinfo, result.portinfo, result.detailedinfo, elapsed = parsed
+    result.timings["parse"] = result.timings.get("parse", 0) + elapsed
+
+
+def inventoryHash(devicelist):
+    """
+    Hash the switch names & addresses from the config file,
+    so an unchanged inventory can skip reconciliation
+    """
+    fingerprint = hashlib.sha1()
+    for switch in sorted(devicelist):
+        fingerprint.update(repr((switch, devicelist[switch]["address"])).encode())
+    return fingerprint.hexdigest()
 
 
 def addDeviceToDB(devicelist):
     """
     Update DB entries for each switch from the config file
     """
-    print("Opening DB connection...")
-    swDB = switchdb.DB()
-    # Get a list of current switches in the database
-    # Compare between new config file - see what should be added/removed
-    curswitches = swDB.getAllSummary()
-    currentSwitches = [row[3] for row in curswitches]
-    newSwitches = [devicelist[switch]["address"] for switch in devicelist]
-    swRemove = set(currentSwitches).difference(newSwitches)
-    swAdd = set(newSwitches).difference(currentSwitches)
-    # If switches to remove, purge from the database
-    if len(swRemove) > 0:
-        print(f"Found {len(swRemove)} switches no longer in config file")
-        for switchIP in swRemove:
-            print(f"Removing switch ({switchIP}) from DB...")
-            swDB.deleteSwitch(switchIP)
-
-    print("Adding devices to DB...")
-    for switch in devicelist:
-        switchIP = devicelist[switch]["address"]
-        if switchIP in swAdd:
-            print(f"Adding switch ({switch} / {switchIP}) to DB...")
-            swDB.addSwitch(str(switch), str(switchIP))
-        else:
-            print(f"Switch ({switch} / {switchIP}) already in DB. Skipping...")
-    swDB.close()
-
-
-def updateDB(device, ip, sysinfo, portinfo, detailedinfo):
+    swDB = switchdb.getDB()
+    # Clear out raw output left behind by removed switches
+    rawstore.removeOrphans(swDB)
+    confighash = inventoryHash(devicelist)
+    if swDB.getInventoryHash() == confighash:
+        print("Device inventory unchanged, skipping DB update...")
+        return
+    # Compare between new config file & DB - add/remove/rename as needed
+    print("Updating devices in DB...")
+    switches = [
+        (str(switch), str(devicelist[switch]["address"])) for switch in devicelist
+    ]
+    added, removed = swDB.syncSwitches(switches, confighash)
+    if removed:
+        print(f"Removed {len(removed)} switches no longer in config file")
+        rawstore.removeOrphans(swDB)
+    print(f"Added {len(added)} new switches to DB")
+
+
+def updateDB(result, polled=True):
     """
     Insert new system & port information
-    into the database
+    from a completed poll into the database,
+    and mark the check as succeeded.
+    Re-parsed results (polled=False) leave the check status
+    & port history alone
+    """
+    swDB = switchdb.getDB()
+    print(f"Updating system, port & check info for {result.name} in DB...")
+    result.changes = swDB.updateDevice(
+        result.name,
+        result.ip,
+        result.sysinfo,
+        result.portinfo,
+        result.detailedinfo,
+        interfaceFingerprint(result),
+        polled,
+        result.polled_at,
+    )
+    print(f"{result.changes} interface changes for {result.name} since last poll")
+
+
+def keepAddresses(result):
+    """
+    Lean polls don't collect MAC addresses,
+    so carry them over from the interfaces already in the DB
+    """
+    known = switchdb.getDB().getInterfaceAddresses(result.ip)
+    result.detailedinfo = [
+        iface
+        if iface.phys_address
+        else iface._replace(phys_address=known.get(iface.int_name, "N/A"))
+        for iface in result.detailedinfo
+    ]
+
+
+def interfaceFingerprint(result):
+    """
+    Hash the interface set collected for a device, so that
+    unchanged switches can skip interface DB writes entirely
+    """
+    fingerprint = hashlib.sha1(result.name.encode())
+    fingerprint.update(result.sysinfo.serial.encode())
+    for iface in sorted(result.detailedinfo):
+        fields = (
+            iface.int_name,
+            iface.oper_status,
+            iface.oper_speed,
+            iface.oper_duplex,
+            iface.description,
+            iface.phys_address,
+        )
+        fingerprint.update(repr(fields).encode())
+    return fingerprint.hexdigest()
+
+
+def formatTimings(timings):
+    """
+    Summarise per-stage timings for progress output
+    """
+    return ", ".join(
+        f"{stage} {timings.get(stage, 0):.2f}s" for stage in switchdb.TIMING_STAGES
+    )
+
+
+def updateTimings(results):
+    """
+    Call to DB - record per-stage timings of completed polls
+    """
+    if not results:
+        return
+    swDB = switchdb.getDB()
+    print(f"Recording poll timings for {len(results)} devices in DB...")
+    now = time.time()
+    swDB.addDeviceTimings([(result.ip, now, result.timings) for result in results])
+
+
+def updateSweepTiming(duration, devices, succeeded):
     """
-    swDB = switchdb.DB()
-    print(f"Updating system info for {device} in DB...")
-    swDB.updateSysInfo(device, ip, sysinfo)
-    print(f"Updating port info for {device} in DB...")
-    swDB.updatePorts(device, ip, portinfo)
-    print(f"Updating detailed port info for {device} in DB...")
-    swDB.updateInterfaceDetails(device, ip, sysinfo, detailedinfo)
-    swDB.close()
+    Call to DB - record how long a full sweep took
+    """
+    swDB = switchdb.getDB()
+    print(f"Sweep of {devices} devices took {duration:.1f}s ({succeeded} succeeded)")
+    swDB.addSweepTiming(duration, devices, succeeded)
+
+
+def updateHistory(settings):
+    """
+    Call to DB - roll up & expire port count history
+    """
+    swDB = switchdb.getDB()
+    print("Rolling up port history in DB...")
+    swDB.rollupHistory(
+        settings["history_raw_hours"],
+        settings["history_hourly_days"],
+        settings["history_daily_days"],
+    )
 
 
 def updateLastRun():
     """
     Call to DB - update last run time
     """
-    swDB = switchdb.DB()
+    swDB = switchdb.getDB()
     print("Updating last run time in DB...")
     swDB.updateLastRun()
-    swDB.close()
 
 
 def updateCheckStatus(device, ip, status):
@@ -249,48 +573,640 @@ def updateCheckStatus(device, ip, status):
     Update the last_check database field,
     which indicates if the check passed or failed
     """
-    swDB = switchdb.DB()
+    swDB = switchdb.getDB()
     print(f"Updating check status for {device} to {status}")
     swDB.updateStatus(device, ip, status)
-    swDB.close()
 
 
-def run():
+def updateCheckStatuses(devices, devicelist, status):
     """
-    Primay function to manage device data collection
+    Update the last_check field for several devices
+    in a single transaction
     """
-    # Load all of our devices from config, then add to DB
-    devicelist = loadDevices()
-    addDeviceToDB(devicelist)
-    # Iterate through each device for processing
-    for device in devicelist:
-        dev = device
-        ip = devicelist[device]["address"]
+    swDB = switchdb.getDB()
+    print(f"Updating check status for {len(devices)} devices to {status}")
+    with swDB.conn:
+        for device in devices:
+            swDB.updateStatus(
+                device, devicelist[device]["address"], status, commit=False
+            )
+
+
+def probeDevice(deviceconfig, timeout):
+    """
+    Check whether a device accepts TCP connections on its SSH port
+    """
+    address = (deviceconfig["address"], deviceconfig.get("port", 22))
+    try:
+        with socket.create_connection(address, timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+
+def probeDevices(devices, devicelist, settings):
+    """
+    Quickly check which devices are reachable before spending
+    time on SSH. Unreachable devices are marked failed in the DB.
+    Returns lists of reachable & unreachable devices
+    """
+    print(f"Checking reachability of {len(devices)} devices...")
+    workers = max(min(settings["precheck_workers"], len(devices)), 1)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(
+            lambda device: probeDevice(
+                devicelist[device], settings["precheck_timeout"]
+            ),
+            devices,
+        )
+        reachable = []
+        unreachable = []
+        for device, alive in zip(devices, results):
+            if alive:
+                reachable.append(device)
+            else:
+                print(f"{device} is unreachable, skipping")
+                unreachable.append(device)
+    if unreachable:
+        updateCheckStatuses(unreachable, devicelist, False)
+    return reachable, unreachable
+
+
+def collectDevice(devcon, result, settings, full=True):
+    """
+    Fetch raw system & port info over an open device connection.
+    Unless a full 'show interfaces' dump is wanted, the lean
+    commands are used where the device supports them.
+    Parsing is left to the parse stage, so I/O workers don't
+    spend their time (and the GIL) on CPU-bound work
+    """
+    for platform, (driver, version, interfaces, _) in PLATFORMS.items():
+        if type(devcon) == driver:
+            break
+    result.platform = platform
+    result.version_output = runCommand(
+        devcon, platform, version, settings, result.timings
+    )
+    if not full:
+        lean = []
+        for command in LEAN_COMMANDS[platform]:
+            start = time.perf_counter()
+            lean.append(devcon.send_command(command).result)
+            addTiming(result.timings, "command", start)
+        if not any(parsers.commandRejected(output) for output in lean):
+            result.lean_output = tuple(lean)
+            return
+        print(f"{result.ip} doesn't support the lean commands, using '{interfaces}'")
+    result.interface_output = runCommand(
+        devcon, platform, interfaces, settings, result.timings
+    )
+    result.raw_output = result.interface_output[1]
+
+
+def pollDevice(device, deviceconfig, settings, started, sessions=None, full=True):
+    """
+    Connect to a single device & collect system / port info.
+    Runs inside a worker thread - no DB access happens here,
+    results are handed back to the Pipeline which does all DB writes
+    """
+    started[device] = time.monotonic()
+    result = PollResult(device, deviceconfig["address"])
+    start = time.perf_counter()
+    if sessions is None:
         # Open device connection
-        devcon = connectToDevice(devicelist[device])
-        if devcon:
+        devcon = connectToDevice(deviceconfig)
+        addTiming(result.timings, "connect", start)
+        if not devcon:
+            return None
+        try:
+            collectDevice(devcon, result, settings, full)
+        finally:
+            devcon.close()
+        return result
+    devcon, reused = sessions.acquire(deviceconfig)
+    addTiming(result.timings, "connect", start)
+    if not devcon:
+        return None
+    try:
+        collectDevice(devcon, result, settings, full)
+    except Exception as e:
+        sessions.discard(devcon)
+        if not reused:
+            raise
+        # The cached session may have gone stale - retry once on a new one
+        print(f"Cached session to {result.ip} failed ({e}), reconnecting...")
+        start = time.perf_counter()
+        devcon = connectToDevice(deviceconfig)
+        addTiming(result.timings, "connect", start)
+        if not devcon:
+            return None
+        try:
+            collectDevice(devcon, result, settings, full)
+        except Exception:
+            sessions.discard(devcon)
+            raise
+    sessions.release(deviceconfig, devcon)
+    return result
+
+
+class Pipeline:
+    """
+    Polls devices in three stages: I/O worker threads fetch raw
+    CLI output, a process pool parses it across every CPU core,
+    and the thread calling collect() writes results to the DB.
+    Each device holds a slot from the start of its fetch until it's
+    written, so if parsing or the DB fall behind, the I/O workers
+    wait rather than piling up raw output in memory
+    """
+
+    def __init__(self, settings, sessions=None):
+        self.settings = settings
+        self.sessions = sessions
+        self.io = ThreadPoolExecutor(max_workers=settings["max_workers"])
+        # With no parse workers, devices are parsed in the I/O threads
+        self.parsers = getParsePool(settings)
+        self.slots = threading.BoundedSemaphore(
+            settings["max_workers"] + settings["parse_backlog"]
+        )
+        # Stage, device, device config & poll result of each running future
+        self.futures = {}
+        # Track when each fetch actually starts, so queued devices
+        # don't count against their own deadline
+        self.started = {}
+        # When each device's full 'show interfaces' output was last archived
+        self.lastfull = switchdb.getDB().getLastCaptures()
+
+    def start(self, device, deviceconfig):
+        """
+        Queue a device to be polled
+        """
+        self.started.pop(device, None)
+        future = self.io.submit(
+            self.fetch, device, deviceconfig, self.wantsFull(deviceconfig)
+        )
+        self.futures[future] = ("fetch", device, deviceconfig, None)
+        return future
+
+    def wantsFull(self, deviceconfig):
+        """
+        Whether a device is due a full 'show interfaces' dump.
+        With the lean profile, these are only taken every full_interval
+        """
+        if self.settings["collect_profile"] != "lean":
+            return True
+        last = self.lastfull.get(deviceconfig["address"])
+        return last is None or time.time() - last >= self.settings["full_interval"]
+
+    def running(self):
+        """
+        Names of the devices somewhere in the pipeline
+        """
+        return {device for stage, device, config, result in self.futures.values()}
+
+    def fetch(self, device, deviceconfig, full=True):
+        """
+        I/O stage - runs in a worker thread.
+        Blocks until a slot is free, then polls the device.
+        The slot is released by collect()
+        """
+        self.slots.acquire()
+        result = pollDevice(
+            device, deviceconfig, self.settings, self.started, self.sessions, full
+        )
+        if result and self.parsers is None:
+            addParsed(result, parseResult(result, self.settings))
+        return result
+
+    def collect(self, timeout=1, completed=None):
+        """
+        Wait for running stages to finish. Fetched output is passed to
+        the parse stage & parsed results are written to the DB.
+        Results are only written from the calling thread, so the DB
+        sees a single writer regardless of worker count.
+        Gives up on any fetch which has run past its deadline.
+        Returns whether each finished device succeeded.
+        Successful results are also added to completed, if given
+        """
+        outcomes = {}
+        done, _ = wait(self.futures, timeout=timeout, return_when=FIRST_COMPLETED)
+        for future in done:
+            stage, device, deviceconfig, result = self.futures.pop(future)
+            self.started.pop(device, None)
             try:
-                # Query device for system & port info
-                if type(devcon) == IOSXEDriver:
-                    sysinfo = getSystemInfoXE(devcon)
-                if type(devcon) == NXOSDriver:
-                    sysinfo = getSystemInfoNX(devcon)
-                portinfo, detailedinfo = getInterfaceInfo(devcon)
+                value = future.result()
             except Exception as e:
                 print(f"ERROR: {e}")
-                updateCheckStatus(device, ip, False)
-                continue
-            # Update database with new info
-            updateDB(dev, ip, sysinfo, portinfo, detailedinfo)
-            # Update database with interface detail info
-            # Update if check succeeeded
-            updateCheckStatus(dev, ip, True)
-        else:
-            # Update DB if last check failed
-            updateCheckStatus(device, ip, False)
+                value = None
+            if stage == "fetch":
+                result = value
+                if result and self.parsers is not None:
+                    # Hand off to the parse stage
+                    try:
+                        parse = self.parsers.submit(
+                            parseDevice,
+                            result.platform,
+                            result.version_output,
+                            result.interface_output,
+                            self.settings["parser"],
+                            result.lean_output,
+                        )
+                    except BrokenProcessPool:
+                        print(f"ERROR: parse workers died, unable to parse {device}")
+                        self.restartParsers()
+                        result = None
+                    else:
+                        self.futures[parse] = ("parse", device, deviceconfig, result)
+                        continue
+            elif value:
+                addParsed(result, value)
+            else:
+                result = None
+            self.slots.release()
+            if result:
+                try:
+                    self.write(result)
+                except Exception as e:
+                    # Don't let one bad result stop the whole sweep
+                    print(f"ERROR: failed to save results for {device}: {e}")
+                    result = None
+            if result:
+                if completed is not None:
+                    completed.append(result)
+            else:
+                # Update DB if last check failed
+                updateCheckStatus(device, deviceconfig["address"], False)
+            outcomes[device] = bool(result)
+        # Give up on any device that has run past its deadline
+        now = time.monotonic()
+        for future, (stage, device, deviceconfig, result) in list(self.futures.items()):
+            deadline = deviceconfig.get("timeout", self.settings["device_timeout"])
+            started = self.started.get(device)
+            if stage == "fetch" and started and now - started > deadline:
+                print(f"ERROR: {device} did not finish within {deadline} seconds")
+                del self.futures[future]
+                del self.started[device]
+                self.slots.release()
+                updateCheckStatus(device, deviceconfig["address"], False)
+                outcomes[device] = False
+        return outcomes
+
+    def write(self, result):
+        """
+        DB stage - save a device's raw output & parsed results
+        """
+        # Save a copy of the raw output, only collected by full polls
+        if result.raw_output is not None:
+            start = time.perf_counter()
+            save_raw_output(result.sysinfo.serial, result.raw_output, self.settings)
+            addTiming(result.timings, "save", start)
+            self.lastfull[result.ip] = time.time()
+        # Update database with new info & successful check
+        start = time.perf_counter()
+        if result.lean_output is not None:
+            keepAddresses(result)
+        updateDB(result)
+        addTiming(result.timings, "db", start)
+        print(f"{result.name} timings: {formatTimings(result.timings)}")
+
+    def restartParsers(self):
+        """
+        Replace a broken parse pool, e.g. after the OS
+        killed a worker for running out of memory
+        """
+        self.parsers.shutdown(wait=False)
+        self.parsers = getParsePool(self.settings)
+
+    def shutdown(self):
+        """
+        Stop the worker pools, without blocking on
+        fetches that blew their deadline
+        """
+        cancelPending(self.futures)
+        self.io.shutdown(wait=False)
+        if self.parsers is not None:
+            self.parsers.shutdown()
+
+
+def cancelPending(futures):
+    """
+    Cancel any futures which haven't started running yet.
+    Executor.shutdown(cancel_futures=True) does this, but needs Python 3.9
+    """
+    for future in futures:
+        future.cancel()
+
+
+def getParsePool(settings):
+    """
+    Start a process pool for parsing CLI output.
+    Returns None when parse_workers is 0
+    """
+    workers = settings["parse_workers"]
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 0:
+        return None
+    # Spawn rather than fork, as the collector already has threads running
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=ignoreInterrupts,
+    )
+
+
+def ignoreInterrupts():
+    """
+    Leave Ctrl-C to the main process, which shuts down the parse workers
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def parseResult(result, settings):
+    """
+    Parse a poll result's raw output in the current process
+    """
+    return parseDevice(
+        result.platform,
+        result.version_output,
+        result.interface_output,
+        settings["parser"],
+        result.lean_output,
+    )
+
+
+def run():
+    """
+    Primay function to manage device data collection
+    """
+    # Load all of our devices from config, then poll them
+    settings = loadSettings()
+    devicelist = loadDevices()
+    sweep(devicelist, settings)
+
+
+def sweep(devicelist, settings):
+    """
+    Poll every device once & update the DB.
+    Returns the results of each successful poll
+    """
+    sweepstart = time.perf_counter()
+    addDeviceToDB(devicelist)
+    # Poll devices concurrently, bounded by max_workers
+    sessions = getSessionPool(settings)
+    pipeline = Pipeline(settings, sessions)
+    devices = list(devicelist)
+    # Don't let unreachable devices tie up workers until they time out
+    if settings["precheck"]:
+        devices, _ = probeDevices(devices, devicelist, settings)
+    for device in devices:
+        pipeline.start(device, devicelist[device])
+    completed = []
+    while pipeline.futures:
+        pipeline.collect(completed=completed)
+    pipeline.shutdown()
+    if sessions:
+        sessions.expire()
+    updateHistory(settings)
+    updateTimings(completed)
+    updateSweepTiming(
+        time.perf_counter() - sweepstart, len(devicelist), len(completed)
+    )
     # Finally, update the last-run time!
     updateLastRun()
+    return completed
+
+
+def reparse():
+    """
+    Rebuild port counts & interface details from stored raw output,
+    without connecting to any devices. Useful after parser fixes.
+    System info comes from the DB, as only 'show interfaces' is stored.
+    Lean polls aren't stored, so switches polled since their latest
+    capture are skipped rather than rolled back to older data
+    """
+    settings = loadSettings()
+    devicelist = loadDevices()
+    addDeviceToDB(devicelist)
+    platforms = {
+        deviceconfig["address"]: DEVICE_TYPES[deviceconfig["type"]]
+        for deviceconfig in devicelist.values()
+    }
+    swDB = switchdb.getDB()
+    # Parse in-process if parse_workers is 0
+    pool = getParsePool(settings) or ThreadPoolExecutor(max_workers=1)
+    lastpolls = swDB.getLastPolls()
+    futures = {}
+    reparsed = 0
+    try:
+        for switch in swDB.getPolledSwitches():
+            platform = platforms.get(switch.mgmt_ip)
+            if platform is None:
+                print(f"{switch.name} is no longer in the config file, skipping")
+                continue
+            if isNewerThanCapture(swDB, switch, lastpolls.get(switch.mgmt_ip)):
+                print(f"{switch.name} was polled after its stored output, skipping")
+                continue
+            raw = load_raw_output(switch.serial)
+            if raw is None:
+                print(f"No raw output stored for {switch.name}, skipping")
+                continue
+            command = PLATFORMS[platform][2]
+            if platform == "nxos" and parsers.hasJSON(raw):
+                command = f"{command} | json"
+            # Don't read in more output than the parse workers can keep up with
+            while len(futures) >= settings["parse_backlog"]:
+                reparsed += saveReparsed(futures)
+            future = pool.submit(
+                parseInterfaces, platform, (command, raw), settings["parser"]
+            )
+            futures[future] = switch
+        while futures:
+            reparsed += saveReparsed(futures)
+    finally:
+        cancelPending(futures)
+        pool.shutdown()
+    print(f"Re-parsed stored output for {reparsed} devices")
+    swDB.bumpGeneration()
+
+
+def isNewerThanCapture(swDB, switch, polled_at):
+    """
+    Whether a switch's data in the DB is newer than its latest stored
+    raw output, e.g. after lean polls, which aren't archived.
+    Full polls always archive their output before it's written
+    """
+    if polled_at is None:
+        # Not polled since upgrading, only older raw output exists
+        return False
+    capture = swDB.getLatestCapture(switch.serial)
+    return capture is None or polled_at > capture[3]
+
+
+def saveReparsed(futures):
+    """
+    Wait for re-parsed output & write it to the DB.
+    Returns how many devices were updated
+    """
+    saved = 0
+    done, _ = wait(futures, return_when=FIRST_COMPLETED)
+    for future in done:
+        switch = futures.pop(future)
+        try:
+            portinfo, detailedinfo = future.result()
+        except Exception as e:
+            print(f"ERROR: failed to re-parse output for {switch.name}: {e}")
+            continue
+        result = PollResult(switch.name, switch.mgmt_ip)
+        result.sysinfo = SystemInfo(switch.serial, switch.model, switch.sw_ver)
+        result.portinfo = portinfo
+        result.detailedinfo = detailedinfo
+        try:
+            updateDB(result, polled=False)
+        except Exception as e:
+            print(f"ERROR: failed to save re-parsed output for {switch.name}: {e}")
+            continue
+        saved += 1
+    return saved
+
+
+def pollInterval(deviceconfig, groups, settings):
+    """
+    Seconds between polls of a device - set per device,
+    per group (from the Groups section of config.yml) or globally
+    """
+    if "interval" in deviceconfig:
+        return deviceconfig["interval"]
+    group = groups.get(deviceconfig.get("group")) or {}
+    return group.get("interval", settings["poll_interval"])
+
+
+def nextPoll(deviceconfig, groups, settings, failures):
+    """
+    Seconds until a device should next be polled.
+    Consecutive failures back off exponentially, up to max_backoff,
+    and random jitter spreads polls out over time
+    """
+    delay = pollInterval(deviceconfig, groups, settings)
+    if failures:
+        backoff = delay * 2 ** min(failures, 16)
+        delay = min(backoff, max(delay, settings["max_backoff"]))
+    jitter = settings["jitter"]
+    return delay * random.uniform(1 - jitter, 1 + jitter)
+
+
+def daemon():
+    """
+    Run continuously, polling each device on its own interval
+    rather than sweeping the whole inventory at once
+    """
+    settings = loadSettings()
+    devicelist = loadDevices()
+    groups = loadGroups()
+    addDeviceToDB(devicelist)
+    configtime = os.path.getmtime("config.yml")
+    sessions = getSessionPool(settings)
+    pipeline = Pipeline(settings, sessions)
+    completed = []
+    failures = {}
+    # Next poll time of each device, plus a heap of the same for quick lookup
+    # Stale heap entries are skipped when they don't match the schedule
+    schedule = {}
+    queue = []
+    now = time.monotonic()
+    for device in devicelist:
+        # Spread first polls across each device's interval
+        interval = pollInterval(devicelist[device], groups, settings)
+        schedule[device] = now + random.uniform(0, interval)
+        heapq.heappush(queue, (schedule[device], device))
+    lastpublish = now
+    written = False
+    try:
+        while True:
+            # Pick up inventory changes without a restart
+            if os.path.getmtime("config.yml") != configtime:
+                print("Config file changed, reloading...")
+                configtime = os.path.getmtime("config.yml")
+                settings = loadSettings()
+                devicelist = loadDevices()
+                groups = loadGroups()
+                pipeline.settings = settings
+                addDeviceToDB(devicelist)
+                running = pipeline.running()
+                for device in list(schedule):
+                    if device not in devicelist:
+                        del schedule[device]
+                for device in devicelist:
+                    if device not in schedule and device not in running:
+                        schedule[device] = time.monotonic()
+                        heapq.heappush(queue, (schedule[device], device))
+            # Start every device which is due
+            now = time.monotonic()
+            devices = []
+            while queue and queue[0][0] <= now:
+                due, device = heapq.heappop(queue)
+                if schedule.get(device) != due:
+                    continue
+                del schedule[device]
+                devices.append(device)
+            unreachable = []
+            if devices and settings["precheck"]:
+                devices, unreachable = probeDevices(devices, devicelist, settings)
+            for device in devices:
+                pipeline.start(device, devicelist[device])
+            wake = min(1, max(queue[0][0] - now, 0)) if queue else 1
+            if pipeline.futures:
+                outcomes = pipeline.collect(wake, completed)
+            else:
+                outcomes = {}
+                time.sleep(wake)
+            # Unreachable devices back off just like failed polls
+            for device in unreachable:
+                outcomes[device] = False
+            # Schedule the next poll of each device that finished
+            for device, success in outcomes.items():
+                written = True
+                if device not in devicelist:
+                    continue
+                failures[device] = 0 if success else failures.get(device, 0) + 1
+                delay = nextPoll(devicelist[device], groups, settings, failures[device])
+                schedule[device] = time.monotonic() + delay
+                heapq.heappush(queue, (schedule[device], device))
+            # Periodically publish results to the dashboard
+            sincepublish = time.monotonic() - lastpublish
+            if written and sincepublish >= settings["publish_interval"]:
+                if sessions:
+                    sessions.expire()
+                updateHistory(settings)
+                updateTimings(completed)
+                completed = []
+                updateLastRun()
+                lastpublish = time.monotonic()
+                written = False
+    except KeyboardInterrupt:
+        print("Stopping collector...")
+    finally:
+        pipeline.shutdown()
+        if sessions:
+            sessions.closeAll()
 
 
 if __name__ == "__main__":
-    run()
+    parser = argparse.ArgumentParser(description="Collect switch port data")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument(
+        "--daemon",
+        action="store_true",
+        help="run continuously, polling each device on its own interval",
+    )
+    mode.add_argument(
+        "--reparse",
+        action="store_true",
+        help="rebuild the DB from stored raw output, without polling devices",
+    )
+    args = parser.parse_args()
+    if args.daemon:
+        daemon()
+    elif args.reparse:
+        reparse()
+    else:
+        run()
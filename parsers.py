@@ -0,0 +1,480 @@
+import json
+import re
+
+
+# Interface header lines, e.g:
+#   GigabitEthernet1/0/1 is up, line protocol is up (connected)
+#   Ethernet1/1 is down (Link not connected)
+XE_INT_HEADER = re.compile(
+    r"^(?P<name>\S+) is (?P<status>up|down|administratively down|deleted)"
+    r".*?, line protocol is (?P<protocol>\w+)"
+)
+NX_INT_HEADER = re.compile(r"^(?P<name>\S+) is (?P<status>up|down)(?P<reason>.*)$")
+ADDRESS = re.compile(r"address(?: is|:)\s+(?P<address>[0-9a-fA-F.]+)")
+BANDWIDTH = re.compile(r"BW (?P<bandwidth>\d+) Kbit")
+XE_DUPLEX = re.compile(
+    r"^(?P<duplex>\w+)[-\s][Dd]uplex, *(?P<speed>[^,]+)"
+    r"(?:.*media type is (?P<media>.+)$)?"
+)
+NX_DUPLEX = re.compile(
+    r"^(?P<duplex>\w+)-duplex, *(?P<speed>[^,\s]+)(?: (?P<unit>[^,]+))?"
+    r"(?:.*media type is (?P<media>\S+))?"
+)
+NX_ADMIN = re.compile(r"^admin state is (?P<admin>\w+)")
+
+XE_CHASSIS = re.compile(r"^cisco (?P<chassis>[\w\-/+]+) \(")
+XE_BOARD_ID = re.compile(r"^Processor board ID (?P<serial>[\w\-]+)")
+XE_SYSTEM_SN = re.compile(r"^System Serial Number\s+:\s+(?P<serial>\S+)")
+XE_VERSION = re.compile(r"^Cisco IOS Software.*, Version (?P<version>[^,\s]+)")
+XE_XE_VERSION = re.compile(r"^Cisco IOS XE Software, Version (?P<version>\S+)")
+NX_MODEL = re.compile(r"^cisco (?P<model>.+?) +[Cc]hassis")
+NX_BOARD_ID = re.compile(r"^Processor Board ID (?P<serial>\S+)")
+NX_SYS_VERSION = re.compile(r"^(?:system|NXOS):\s+version (?P<version>\S+)")
+
+# Header lines of tabular output, e.g. 'show interfaces status'
+TABLE_HEADER = re.compile(r"^(?:Port|Interface)\s")
+SHORT_NAME = re.compile(r"^(?P<prefix>[A-Za-z]+)(?P<number>\d.*)$")
+# Full interface names for the abbreviations used in tabular output
+INTERFACE_NAMES = {
+    "Fa": "FastEthernet",
+    "Gi": "GigabitEthernet",
+    "Tw": "TwoGigabitEthernet",
+    "Fi": "FiveGigabitEthernet",
+    "Te": "TenGigabitEthernet",
+    "Twe": "TwentyFiveGigE",
+    "Fo": "FortyGigabitEthernet",
+    "Fif": "FiftyGigE",
+    "Hu": "HundredGigE",
+    "FH": "FourHundredGigE",
+    "Ap": "AppGigabitEthernet",
+    "Et": "Ethernet",
+    "Eth": "Ethernet",
+    "Po": "Port-channel",
+    "Vl": "Vlan",
+    "Lo": "Loopback",
+    "Tu": "Tunnel",
+}
+
+
+def parseInterfacesXE(output):
+    """
+    Parse IOS-XE 'show interfaces' into the same structure
+    (and key names) returned by the Genie parser
+    """
+    interfaces = {}
+    current = None
+    for line in output.splitlines():
+        if not line:
+            continue
+        if not line[0].isspace():
+            match = XE_INT_HEADER.match(line)
+            if match:
+                current = {
+                    "oper_status": match.group("protocol"),
+                    "enabled": match.group("status") != "administratively down",
+                }
+                interfaces[match.group("name")] = current
+            continue
+        if current is None:
+            continue
+        line = line.strip()
+        if line.startswith("Hardware is"):
+            match = ADDRESS.search(line)
+            if match:
+                current["phys_address"] = match.group("address")
+        elif line.startswith("Description:"):
+            current["description"] = line[len("Description:") :].strip()
+        elif line.startswith("MTU"):
+            match = BANDWIDTH.search(line)
+            if match:
+                current["bandwidth"] = int(match.group("bandwidth"))
+        elif "uplex" in line:
+            match = XE_DUPLEX.match(line)
+            if match:
+                current["duplex_mode"] = match.group("duplex").lower()
+                speed = match.group("speed").strip().lower()
+                current["port_speed"] = speed.replace("-speed", "")
+                if match.group("media"):
+                    current["media_type"] = match.group("media").strip()
+    if not interfaces:
+        raise ValueError("no interfaces found in output")
+    return interfaces
+
+
+def parseInterfacesNX(output):
+    """
+    Parse NX-OS 'show interface' into the same structure
+    (and key names) returned by the Genie parser
+    """
+    interfaces = {}
+    current = None
+    for line in output.splitlines():
+        if not line:
+            continue
+        if not line[0].isspace():
+            match = NX_INT_HEADER.match(line)
+            if match:
+                current = {
+                    "oper_status": match.group("status"),
+                    "enabled": "Administratively down" not in match.group("reason"),
+                }
+                interfaces[match.group("name")] = current
+                continue
+            match = NX_ADMIN.match(line)
+            if match and current is not None:
+                current["enabled"] = match.group("admin") == "up"
+            continue
+        if current is None:
+            continue
+        line = line.strip()
+        if line.startswith("Hardware"):
+            match = ADDRESS.search(line)
+            if match:
+                current["phys_address"] = match.group("address")
+        elif line.startswith("Description:"):
+            current["description"] = line[len("Description:") :].strip()
+        elif line.startswith("MTU"):
+            match = BANDWIDTH.search(line)
+            if match:
+                current["bandwidth"] = int(match.group("bandwidth"))
+        elif "-duplex" in line:
+            match = NX_DUPLEX.match(line)
+            if match:
+                current["duplex_mode"] = match.group("duplex").lower()
+                current["port_speed"] = match.group("speed").lower()
+                if match.group("unit"):
+                    current["port_speed_unit"] = match.group("unit")
+                if match.group("media"):
+                    current["media_type"] = match.group("media")
+    if not interfaces:
+        raise ValueError("no interfaces found in output")
+    return interfaces
+
+
+def expandInterface(name):
+    """
+    Expand an abbreviated interface name, e.g. Gi1/0/1, to the
+    full name used by 'show interfaces', e.g. GigabitEthernet1/0/1
+    """
+    match = SHORT_NAME.match(name)
+    if match and match.group("prefix") in INTERFACE_NAMES:
+        return INTERFACE_NAMES[match.group("prefix")] + match.group("number")
+    return name
+
+
+def tableRows(output, columns):
+    """
+    Split fixed-width tabular output into rows. Each header line sets
+    the start of the named columns for the rows below it, as some
+    commands print several tables with different layouts.
+    Yields the expanded interface name & the line of each row,
+    plus the column starts found in the current header
+    """
+    found = None
+    for line in output.splitlines():
+        if not line.strip() or line.startswith("--"):
+            continue
+        if TABLE_HEADER.match(line):
+            found = {column: line.find(column) for column in columns}
+            continue
+        if found is not None:
+            yield expandInterface(line.split(None, 1)[0]), line, found
+
+
+def statusSpeed(speed):
+    """
+    Convert a 'show interfaces status' speed, e.g. 'a-1000' or '10G',
+    into a number & unit. Returns None if the speed isn't known
+    """
+    speed = speed.lower()
+    if speed.startswith("a-"):
+        speed = speed[2:]
+    if speed.endswith("g"):
+        return speed[:-1], "Gb/s"
+    if speed.isdigit():
+        return speed, "Mb/s"
+    return None
+
+
+def parseInterfaceStatus(output):
+    """
+    Parse IOS-XE 'show interfaces status' or NX-OS 'show interface status'.
+    Returns the status, VLAN, duplex, speed & type of each port
+    """
+    interfaces = {}
+    for iface, line, columns in tableRows(output, ("Name", "Status")):
+        name, status = columns["Name"], columns["Status"]
+        if name < 0 or status < 0:
+            continue
+        fields = line[status:].split()
+        if len(fields) < 4:
+            continue
+        description = line[name:status].strip()
+        interfaces[iface] = {
+            "name": "" if description == "--" else description,
+            "status": fields[0],
+            "vlan": fields[1],
+            "duplex": fields[2],
+            "speed": fields[3],
+            "type": " ".join(fields[4:]),
+        }
+    if not interfaces:
+        raise ValueError("no interfaces found in output")
+    return interfaces
+
+
+def parseInterfaceDescription(output):
+    """
+    Parse IOS-XE 'show interfaces description' or NX-OS
+    'show interface description' for untruncated descriptions,
+    plus admin & line protocol status where shown (IOS-XE only)
+    """
+    interfaces = {}
+    columns = ("Status", "Protocol", "Description")
+    for iface, line, found in tableRows(output, columns):
+        start = found["Description"]
+        if start < 0:
+            continue
+        current = {}
+        description = line[start:].strip()
+        if description and description != "--":
+            current["description"] = description
+        if found["Status"] > 0 and found["Protocol"] > found["Status"]:
+            current["status"] = line[found["Status"] : found["Protocol"]].strip()
+            current["protocol"] = line[found["Protocol"] : start].split()[0]
+        interfaces[iface] = current
+    return interfaces
+
+
+def parseInterfacesLean(platform, status, description):
+    """
+    Combine the output of the lean 'show interfaces status' &
+    'show interfaces description' commands into the same structure
+    (and key names) returned by the 'show interfaces' parsers.
+    Neither command shows MAC addresses, so phys_address is set to None,
+    for the collector to fill in from what it already knows
+    """
+    descriptions = parseInterfaceDescription(description)
+    interfaces = {}
+    for iface, row in parseInterfaceStatus(status).items():
+        current = {
+            "oper_status": "up" if row["status"] == "connected" else "down",
+            "enabled": row["status"] != "disabled",
+            "phys_address": None,
+            "bandwidth": 0,
+        }
+        duplex = row["duplex"].lower()
+        current["duplex_mode"] = duplex[2:] if duplex.startswith("a-") else duplex
+        speed = statusSpeed(row["speed"])
+        if speed:
+            value, unit = speed
+            current["bandwidth"] = int(
+                float(value) * (1_000_000 if unit == "Gb/s" else 1000)
+            )
+        # Match the speed format of each platform's 'show interfaces' parser
+        if platform == "nxos":
+            current["port_speed"] = value if speed else "auto-speed"
+            if speed:
+                current["port_speed_unit"] = unit
+        else:
+            current["port_speed"] = f"{value}{unit}".lower() if speed else "auto"
+        if row["type"] and row["type"] != "--":
+            current["media_type"] = row["type"]
+        if row["name"]:
+            current["description"] = row["name"]
+        extra = descriptions.get(iface, {})
+        if "description" in extra:
+            current["description"] = extra["description"]
+        if "protocol" in extra:
+            current["oper_status"] = extra["protocol"]
+            current["enabled"] = extra["status"] != "admin down"
+        interfaces[iface] = current
+    return interfaces
+
+
+def parseVersionXE(output):
+    """
+    Parse IOS-XE 'show version' for chassis, serial & software version.
+    Returns the subset of the Genie structure used by the collector
+    """
+    version = {}
+    for line in output.splitlines():
+        line = line.strip()
+        for pattern, key in (
+            (XE_CHASSIS, "chassis"),
+            (XE_BOARD_ID, "chassis_sn"),
+            (XE_SYSTEM_SN, "chassis_sn"),
+            (XE_VERSION, "version"),
+            (XE_XE_VERSION, "xe_version"),
+        ):
+            if key in version:
+                continue
+            match = pattern.match(line)
+            if match:
+                version[key] = match.group(1)
+    # Older releases only print the 'Cisco IOS XE Software' version line
+    if "version" not in version and "xe_version" in version:
+        version["version"] = version["xe_version"]
+    for key in ("chassis", "chassis_sn", "version"):
+        if key not in version:
+            raise ValueError(f"'{key}' not found in output")
+    return {"version": version}
+
+
+def parseVersionNX(output):
+    """
+    Parse NX-OS 'show version' for model, serial & software version.
+    Returns the subset of the Genie structure used by the collector
+    """
+    hardware = {}
+    software = {}
+    for line in output.splitlines():
+        line = line.strip()
+        if "model" not in hardware:
+            match = NX_MODEL.match(line)
+            if match:
+                hardware["model"] = match.group("model")
+                continue
+        if "processor_board_id" not in hardware:
+            match = NX_BOARD_ID.match(line)
+            if match:
+                hardware["processor_board_id"] = match.group("serial")
+                continue
+        if "system_version" not in software:
+            match = NX_SYS_VERSION.match(line)
+            if match:
+                software["system_version"] = match.group("version")
+    for key, found in (
+        ("model", hardware),
+        ("processor_board_id", hardware),
+        ("system_version", software),
+    ):
+        if key not in found:
+            raise ValueError(f"'{key}' not found in output")
+    return {"platform": {"hardware": hardware, "software": software}}
+
+
+def loadJSON(output):
+    """
+    Load structured ('| json') output from an NX-OS device.
+    Raises ValueError if the device didn't return JSON,
+    e.g. because the command isn't supported
+    """
+    start = output.find("{")
+    if start == -1:
+        raise ValueError("no JSON found in output")
+    return json.loads(output[start:])
+
+
+def hasJSON(output):
+    """
+    Whether a device returned JSON at all, e.g. rather
+    than an error because '| json' isn't supported.
+    Text output may contain braces too (e.g. in descriptions),
+    so the output must start with a JSON object
+    """
+    return output.lstrip().startswith("{")
+
+
+def commandRejected(output):
+    """
+    Whether a device rejected a command, e.g. with
+    '% Invalid input detected' because it isn't supported
+    """
+    for line in output.splitlines():
+        line = line.strip()
+        if line and line != "^":
+            return line.startswith("%")
+    return True
+
+
+def jsonRows(data, table, row):
+    """
+    NX-OS returns a single dict instead of a list
+    when a table only has one row
+    """
+    rows = data.get(table, {}).get(row, [])
+    if isinstance(rows, dict):
+        rows = [rows]
+    return rows
+
+
+def parseInterfacesNXJSON(output):
+    """
+    Map NX-OS 'show interface | json' into the same structure
+    returned by parseInterfacesNX / the Genie parser
+    """
+    interfaces = {}
+    for row in jsonRows(loadJSON(output), "TABLE_interface", "ROW_interface"):
+        current = {
+            "oper_status": row.get("state", "down"),
+            "enabled": row.get("admin_state", "up") == "up",
+        }
+        if "eth_hw_addr" in row:
+            current["phys_address"] = row["eth_hw_addr"]
+        if row.get("desc"):
+            current["description"] = row["desc"]
+        if "eth_bw" in row:
+            current["bandwidth"] = int(row["eth_bw"])
+        if "eth_duplex" in row:
+            current["duplex_mode"] = row["eth_duplex"].lower()
+        if "eth_speed" in row:
+            speed = row["eth_speed"].split(" ", 1)
+            current["port_speed"] = speed[0].lower()
+            if len(speed) > 1:
+                current["port_speed_unit"] = speed[1]
+        if "eth_media" in row:
+            current["media_type"] = row["eth_media"]
+        interfaces[row["interface"]] = current
+    if not interfaces:
+        raise ValueError("no interfaces found in output")
+    return interfaces
+
+
+def parseVersionNXJSON(output):
+    """
+    Map NX-OS 'show version | json' into the same structure
+    returned by parseVersionNX / the Genie parser
+    """
+    data = loadJSON(output)
+    version = data.get("nxos_ver_str") or data.get("sys_ver_str")
+    if not version or "proc_board_id" not in data or "chassis_id" not in data:
+        raise ValueError("model, serial or version missing from output")
+    model = re.sub(r" +[Cc]hassis$", "", data["chassis_id"])
+    return {
+        "platform": {
+            "hardware": {"model": model, "processor_board_id": data["proc_board_id"]},
+            "software": {"system_version": version},
+        }
+    }
+
+
+# Built-in parser for each (platform, command) the collector sends
+BUILTIN_PARSERS = {
+    ("iosxe", "show interfaces"): parseInterfacesXE,
+    ("iosxe", "show version"): parseVersionXE,
+    ("nxos", "show interface"): parseInterfacesNX,
+    ("nxos", "show version"): parseVersionNX,
+    ("nxos", "show interface | json"): parseInterfacesNXJSON,
+    ("nxos", "show version | json"): parseVersionNXJSON,
+}
+
+
+def parseOutput(platform, command, output, parser="builtin"):
+    """
+    Parse raw CLI output using the selected parser.
+    The built-in parsers fall back to Genie if they can't
+    handle the output. Structured ('| json') output is
+    always handled here, Genie has no parsers for it
+    """
+    if command.endswith("| json"):
+        return BUILTIN_PARSERS[(platform, command)](output)
+    if parser == "builtin" and (platform, command) in BUILTIN_PARSERS:
+        try:
+            return BUILTIN_PARSERS[(platform, command)](output)
+        except ValueError as e:
+            print(f"Built-in parser failed for '{command}', using Genie: {e}")
+    # Only import Genie when it's actually needed
+    from scrapli.helper import genie_parse
+
+    return genie_parse(platform, command, output)
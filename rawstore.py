@@ -0,0 +1,153 @@
+import gzip
+import hashlib
+import io
+import os
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+RAW_DIR = "raw_output"
+# File extension of each compression codec
+CODECS = {"gzip": ".gz", "zstd": ".zst"}
+
+# Object directories already known to exist
+_dirs = set()
+# Only warn once about zstd being unavailable
+_warned = False
+
+
+def resolveCodec(codec):
+    """
+    Fall back to gzip if zstd is selected but not installed
+    """
+    global _warned
+    if codec == "zstd" and zstandard is None:
+        if not _warned:
+            print("zstandard is not installed, compressing raw output with gzip")
+            _warned = True
+        return "gzip"
+    if codec not in CODECS:
+        raise ValueError(f"Unknown raw output codec '{codec}'")
+    return codec
+
+
+def objectPath(digest, codec):
+    """
+    Path of a stored capture. Captures are content-addressed,
+    so identical output is only ever stored once
+    """
+    return os.path.join(RAW_DIR, "objects", digest[:2], digest + CODECS[codec])
+
+
+def legacyPath(serial):
+    """
+    Find output saved by older versions, as raw_output/<serial>.txt(.gz).
+    Returns the path & codec, or None
+    """
+    # Serials come from URLs, so don't let them point outside RAW_DIR
+    if not serial or serial.startswith(".") or os.path.basename(serial) != serial:
+        return None
+    for filename, codec in ((f"{serial}.txt", None), (f"{serial}.txt.gz", "gzip")):
+        path = os.path.join(RAW_DIR, filename)
+        if os.path.exists(path):
+            return path, codec
+    return None
+
+
+def writeObject(path, data, codec):
+    """
+    Compress & write a capture, via a temporary file so
+    readers never see a partly written capture
+    """
+    directory = os.path.dirname(path)
+    if directory not in _dirs:
+        os.makedirs(directory, exist_ok=True)
+        _dirs.add(directory)
+    if codec == "zstd":
+        compressed = zstandard.ZstdCompressor().compress(data)
+    else:
+        compressed = gzip.compress(data)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as a:
+        a.write(compressed)
+    os.replace(tmp, path)
+
+
+def save(swDB, serial, data, codec="gzip", keep=10):
+    """
+    Archive a capture of raw CLI output for a switch,
+    keeping the latest 'keep' distinct captures.
+    Output identical to the latest capture only updates its last seen time
+    """
+    codec = resolveCodec(codec)
+    encoded = data.encode()
+    digest = hashlib.sha256(encoded).hexdigest()
+    latest = swDB.getLatestCapture(serial)
+    if latest and latest[0] == digest:
+        codec = latest[1]
+    path = objectPath(digest, codec)
+    if not os.path.exists(path):
+        writeObject(path, encoded, codec)
+    if latest and latest[0] == digest:
+        swDB.touchCapture(serial, latest[2])
+        return
+    # Drop captures past the limit, and any objects no longer referenced
+    swDB.addCapture(serial, digest, codec, len(encoded), keep)
+    removeOrphans(swDB)
+    # Older versions kept a single uncompressed copy per switch
+    legacy = legacyPath(serial)
+    if legacy:
+        os.remove(legacy[0])
+
+
+def removeOrphans(swDB):
+    """
+    Delete stored objects left without any capture, e.g. after
+    older captures were dropped or a switch was removed
+    """
+    for digest, codec in swDB.takeOrphans():
+        try:
+            os.remove(objectPath(digest, codec))
+        except FileNotFoundError:
+            pass
+
+
+def latest(swDB, serial):
+    """
+    Locate the latest capture for a switch.
+    Returns the file path & codec (None if uncompressed), or None
+    """
+    capture = swDB.getLatestCapture(serial)
+    if capture:
+        path = objectPath(capture[0], capture[1])
+        if os.path.exists(path):
+            return path, capture[1]
+    return legacyPath(serial)
+
+
+def openCapture(path, codec):
+    """
+    Open a stored capture as text
+    """
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstandard is needed to read zstd raw output")
+        reader = zstandard.ZstdDecompressor().stream_reader(open(path, "rb"))
+        return io.TextIOWrapper(reader)
+    if codec == "gzip":
+        return gzip.open(path, "rt")
+    return open(path, "r")
+
+
+def load(swDB, serial):
+    """
+    Read the latest capture for a switch, or None if there isn't one
+    """
+    found = latest(swDB, serial)
+    if found is None:
+        return None
+    with openCapture(*found) as a:
+        return a.read()
@@ -0,0 +1,79 @@
+from collections import namedtuple
+from typing import NamedTuple
+
+from buckets import COUNTER_COLUMNS
+
+
+# Compact, immutable records shared by the collector, DB & web layers.
+# Field names match the DB columns, so rows can be built directly
+# by sqlite3 row factories - see rowFactory()
+
+
+class SystemInfo(NamedTuple):
+    """
+    Inventory details from 'show version'
+    """
+
+    serial: str
+    model: str
+    sw_ver: str
+
+
+# Port counters for a switch, or totalled across the network.
+# Fields come from the counter registry in buckets.py
+PortCounts = namedtuple(
+    "PortCounts", COUNTER_COLUMNS, defaults=(0,) * len(COUNTER_COLUMNS)
+)
+
+
+class Interface(NamedTuple):
+    """
+    Operational details of a single interface
+    """
+
+    int_name: str
+    oper_status: str
+    description: str
+    phys_address: str
+    oper_speed: str
+    oper_duplex: str
+
+
+class SwitchSummary(NamedTuple):
+    """
+    One row of the switch inventory list
+    """
+
+    name: str
+    serial: str
+    model: str
+    sw_ver: str
+    mgmt_ip: str
+    last_check: bool
+    total_port: int
+    up_port: int
+    down_port: int
+    disabled_port: int
+    capacity: float
+
+
+# Everything known about one switch
+SwitchDetail = namedtuple(
+    "SwitchDetail",
+    ("name", "serial", "model", "sw_ver", "mgmt_ip", "last_check")
+    + PortCounts._fields
+    + ("capacity",),
+)
+
+
+def rowFactory(record):
+    """
+    sqlite3 row factory which builds the given record type
+    from each row, instead of a plain tuple
+    """
+    make = record._make
+
+    def factory(cursor, row):
+        return make(row)
+
+    return factory
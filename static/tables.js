@@ -0,0 +1,50 @@
+// Fills a table a page at a time from the dashboard's JSON API.
+// Column headers with a data-sort attribute re-sort the table server-side.
+function lazyTable(table, url, renderRow) {
+   var tbody = table.find("tbody");
+   var more = $('<button type="button" class="btn btn-secondary">Load more</button>');
+   var params = {};
+   var next = null;
+   more.hide().insertAfter(table);
+
+   function load(reset) {
+      var query = $.extend({}, params);
+      if (!reset) {
+         query.after = next;
+      }
+      $.getJSON(url, query).done(function (page) {
+         if (reset) {
+            tbody.empty();
+         }
+         $.each(page.items, function (i, item) {
+            tbody.append(renderRow(item));
+         });
+         next = page.next;
+         more.toggle(next !== null);
+      });
+   }
+
+   more.click(function () {
+      load(false);
+   });
+   table.find("th[data-sort]").css("cursor", "pointer").click(function () {
+      var sort = $(this).data("sort");
+      params.order = params.sort === sort && params.order === "asc" ? "desc" : "asc";
+      params.sort = sort;
+      load(true);
+   });
+   load(true);
+
+   return {
+      // Replace the current filters & reload from the first page
+      filter: function (filters) {
+         params = $.extend({sort: params.sort, order: params.order}, filters);
+         load(true);
+      }
+   };
+}
+
+// Table cell containing plain text
+function textCell(value) {
+   return $("<td>").text(value === null ? "" : value);
+}
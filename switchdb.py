@@ -1,23 +1,300 @@
+import queue
+import re
 import sqlite3
+import threading
+import time
 from datetime import datetime
 from sqlite3 import Error
 
+from records import Interface, PortCounts, SwitchDetail, SwitchSummary, rowFactory
+
+DB_PATH = "./sw-util.db"
+# Max number of idle connections kept by acquireDB() / releaseDB()
+POOL_SIZE = 8
+
+# Schema creation only needs to happen once per process, per DB file
+_schema_lock = threading.Lock()
+_schema_ready = set()
+_local = threading.local()
+_pool = queue.LifoQueue(maxsize=POOL_SIZE)
+
+# Port counters kept in switches & port_history, see buckets.py
+HISTORY_COLUMNS = PortCounts._fields
+# Bucket size, in seconds, of each history rollup period
+HISTORY_PERIODS = {"hour": 3600, "day": 86400}
+# Collection stages timed for each device poll
+TIMING_STAGES = ("connect", "command", "parse", "save", "db")
+# Number of full collector sweeps kept in sweep_timings
+SWEEP_HISTORY = 1000
+
+# Percentage of ports in use on a switch
+CAPACITY_SQL = "CASE WHEN total_port = 0 THEN 0 ELSE up_port * 100.0 / total_port END"
+# Sort keys accepted by querySwitches / queryInterfaces,
+# mapped to the record field (and column) they sort on
+SWITCH_SORTS = {
+    "name": "name",
+    "serial": "serial",
+    "model": "model",
+    "swver": "sw_ver",
+    "ip": "mgmt_ip",
+    "total": "total_port",
+    "up": "up_port",
+    "down": "down_port",
+    "disabled": "disabled_port",
+    "capacity": "capacity",
+}
+# Switch record fields which are calculated rather than stored
+SWITCH_EXPRESSIONS = {"capacity": CAPACITY_SQL}
+INTERFACE_SORTS = {
+    "port": "int_name",
+    "name": "int_name",
+    "description": "description",
+    "status": "oper_status",
+    "speed": "oper_speed",
+    "duplex": "oper_duplex",
+}
+# Interface sort keys ordered by a SQL function of their column,
+# rather than the column itself
+INTERFACE_FUNCTIONS = {"port": "port_order"}
+# Runs of digits in an interface name, e.g. the 1, 0 & 10 in Gi1/0/10
+PORT_NUMBER = re.compile(r"\d+")
+
+# Schema migrations, applied in order by DB.migrateDB()
+# The DB's PRAGMA user_version records how many have been applied,
+# so existing sw-util.db files are upgraded in place.
+# Only ever append to this list - never edit an applied migration
+MIGRATIONS = [
+    # 1: Key interface_detailed on (mgmt_ip, int_name) rather than MAC,
+    # and index the serial lookups used by the switch detail page
+    """ CREATE TABLE interface_detailed_new (
+            sw_name text NOT NULL,
+            mgmt_ip text NOT NULL,
+            int_name text NOT NULL,
+            oper_status text NOT NULL,
+            description text DEFAULT "N/A",
+            phys_address text NOT NULL,
+            serial text NOT NULL,
+            oper_speed text NOT NULL,
+            oper_duplex text NOT NULL,
+            PRIMARY KEY (mgmt_ip, int_name)
+        );
+        INSERT OR REPLACE INTO interface_detailed_new
+            SELECT sw_name, mgmt_ip, int_name, oper_status, description,
+            phys_address, serial, oper_speed, oper_duplex
+            FROM interface_detailed;
+        DROP TABLE interface_detailed;
+        ALTER TABLE interface_detailed_new RENAME TO interface_detailed;
+        CREATE INDEX interface_detailed_serial ON interface_detailed(serial);
+        CREATE INDEX switches_serial ON switches(serial);
+    """,
+    # 2: Fingerprint of the last interface set written for each switch
+    """ ALTER TABLE switches ADD COLUMN int_fingerprint text;
+    """,
+    # 3: Port counter history - one 'raw' row per switch per poll,
+    # rolled up into 'hour' and 'day' averages over time
+    """ CREATE TABLE port_history (
+            mgmt_ip text NOT NULL,
+            period text NOT NULL,
+            ts integer NOT NULL,
+            samples integer DEFAULT 1,
+            total_port real DEFAULT 0,
+            up_port real DEFAULT 0,
+            down_port real DEFAULT 0,
+            disabled_port real DEFAULT 0,
+            intop10m real DEFAULT 0,
+            intop100m real DEFAULT 0,
+            intop1g real DEFAULT 0,
+            intop10g real DEFAULT 0,
+            intop25g real DEFAULT 0,
+            intop40g real DEFAULT 0,
+            intop100g real DEFAULT 0,
+            intmedcop real DEFAULT 0,
+            intmedsfp real DEFAULT 0,
+            intmedvirt real DEFAULT 0,
+            PRIMARY KEY (mgmt_ip, period, ts)
+        );
+        CREATE INDEX port_history_period ON port_history(period, ts);
+    """,
+    # 4: Cover the GROUP BY queries used for the network-wide top 5 lists
+    """ CREATE INDEX switches_model ON switches(model);
+        CREATE INDEX switches_sw_ver ON switches(sw_ver);
+    """,
+    # 5: Sweep generation counter, bumped each time the collector
+    # finishes, so the dashboard knows when its cached pages are stale
+    """ ALTER TABLE last_update ADD COLUMN generation integer DEFAULT 0;
+        ALTER TABLE last_update ADD COLUMN lastrun_ts real;
+    """,
+    # 6: Per-stage timings of each switch's latest poll,
+    # plus the duration of recent full collector sweeps
+    """ CREATE TABLE device_timings (
+            mgmt_ip text PRIMARY KEY,
+            ts real NOT NULL,
+            connect real DEFAULT 0,
+            command real DEFAULT 0,
+            parse real DEFAULT 0,
+            save real DEFAULT 0,
+            db real DEFAULT 0
+        );
+        CREATE TABLE sweep_timings (
+            ts real PRIMARY KEY,
+            duration real NOT NULL,
+            devices integer NOT NULL,
+            succeeded integer NOT NULL
+        );
+    """,
+    # 7: Hash of the device inventory last reconciled from config.yml,
+    # and clean up everything belonging to a switch when it's deleted
+    """ ALTER TABLE last_update ADD COLUMN inventory_hash text;
+        CREATE TRIGGER switches_delete AFTER DELETE ON switches
+        BEGIN
+            DELETE FROM interface_detailed WHERE mgmt_ip = OLD.mgmt_ip;
+            DELETE FROM port_history WHERE mgmt_ip = OLD.mgmt_ip;
+            DELETE FROM device_timings WHERE mgmt_ip = OLD.mgmt_ip;
+        END;
+        DELETE FROM interface_detailed
+            WHERE mgmt_ip NOT IN (SELECT mgmt_ip FROM switches);
+        DELETE FROM port_history
+            WHERE mgmt_ip NOT IN (SELECT mgmt_ip FROM switches);
+        DELETE FROM device_timings
+            WHERE mgmt_ip NOT IN (SELECT mgmt_ip FROM switches);
+    """,
+    # 8: Index of the raw output captures archived for each switch,
+    # see rawstore.py. Unchanged output just bumps last_seen
+    """ CREATE TABLE raw_captures (
+            serial text NOT NULL,
+            first_seen real NOT NULL,
+            last_seen real NOT NULL,
+            digest text NOT NULL,
+            codec text NOT NULL,
+            size integer NOT NULL,
+            PRIMARY KEY (serial, first_seen)
+        );
+        CREATE INDEX raw_captures_digest ON raw_captures(digest);
+    """,
+    # 9: Remove a switch's raw output captures along with the switch.
+    # Objects of deleted captures are queued in raw_orphans, so the
+    # collector can delete any which are no longer referenced from disk
+    """ CREATE TABLE raw_orphans (
+            digest text NOT NULL,
+            codec text NOT NULL,
+            PRIMARY KEY (digest, codec)
+        );
+        CREATE TRIGGER raw_captures_delete AFTER DELETE ON raw_captures
+        BEGIN
+            INSERT OR IGNORE INTO raw_orphans (digest, codec)
+                VALUES (OLD.digest, OLD.codec);
+        END;
+        DROP TRIGGER switches_delete;
+        CREATE TRIGGER switches_delete AFTER DELETE ON switches
+        BEGIN
+            DELETE FROM interface_detailed WHERE mgmt_ip = OLD.mgmt_ip;
+            DELETE FROM port_history WHERE mgmt_ip = OLD.mgmt_ip;
+            DELETE FROM device_timings WHERE mgmt_ip = OLD.mgmt_ip;
+            DELETE FROM raw_captures WHERE serial = OLD.serial
+                AND serial NOT IN (SELECT serial FROM switches);
+        END;
+        DELETE FROM raw_captures
+            WHERE serial NOT IN (SELECT serial FROM switches);
+    """,
+    # 10: When the data from each switch's latest successful poll was
+    # collected, so --reparse can tell if stored raw output is older
+    """ ALTER TABLE switches ADD COLUMN last_poll real;
+    """,
+]
+
+
+def portOrder(int_name):
+    """
+    Sort key listing interfaces in port order, so Gi1/0/2 comes
+    before Gi1/0/10. Registered with SQLite as port_order()
+    """
+    return PORT_NUMBER.sub(lambda number: number.group().zfill(10), int_name)
+
+
+def splitStatements(script):
+    """
+    Split a migration into single statements, as executescript()
+    would commit the transaction it has to run in
+    """
+    statements = []
+    statement = ""
+    for part in script.split(";"):
+        statement += part + ";"
+        # Semicolons inside triggers & strings don't end the statement
+        if sqlite3.complete_statement(statement):
+            if statement.strip() != ";":
+                statements.append(statement.strip())
+            statement = ""
+    return statements
+
+
+def getDB():
+    """
+    Return a long-lived DB connection owned by the calling thread,
+    opening it on first use
+    """
+    swDB = getattr(_local, "db", None)
+    if swDB is None or swDB.path != DB_PATH:
+        swDB = DB()
+        _local.db = swDB
+    return swDB
+
+
+def acquireDB():
+    """
+    Borrow a connection from the shared pool,
+    opening a new one if none are idle
+    """
+    while True:
+        try:
+            swDB = _pool.get_nowait()
+        except queue.Empty:
+            return DB(shared=True)
+        if swDB.path == DB_PATH:
+            return swDB
+        swDB.close()
+
+
+def releaseDB(swDB):
+    """
+    Return a borrowed connection to the pool,
+    closing it if the pool is already full
+    """
+    try:
+        _pool.put_nowait(swDB)
+    except queue.Full:
+        swDB.close()
+
 
 class DB:
-    def __init__(self):
-        self.openDB()
-        self.createDB()
-        self.initLastUpdate()
+    def __init__(self, shared=False):
+        self.path = DB_PATH
+        self.openDB(shared)
+        with _schema_lock:
+            if self.path not in _schema_ready:
+                self.createDB()
+                self.initLastUpdate()
+                _schema_ready.add(self.path)
 
-    def openDB(self):
+    def openDB(self, shared=False):
         """
         Open SQLlite DB
+        WAL mode lets the dashboard keep reading while the collector writes.
+        Shared connections may be handed between threads by the pool
         """
         self.conn = None
         try:
-            self.conn = sqlite3.connect("./sw-util.db")
+            self.conn = sqlite3.connect(
+                self.path, timeout=30, check_same_thread=not shared
+            )
         except Error as e:
             print(e)
+            return
+        self.conn.create_function("port_order", 1, portOrder)
+        cur = self.conn.cursor()
+        cur.execute("PRAGMA journal_mode = WAL;")
+        cur.execute("PRAGMA synchronous = NORMAL;")
+        cur.execute("PRAGMA temp_store = MEMORY;")
 
     def createDB(self):
         """
@@ -64,6 +341,64 @@ class DB:
         cur.execute(sw_info_table)
         cur.execute(last_update_table)
         cur.execute(interface_detail_table)
+        self.migrateDB()
+        self.addCounterColumns()
+
+    def migrateDB(self):
+        """
+        Bring an existing DB up to the current schema version.
+        Each migration runs in its own transaction together
+        with the user_version bump
+        """
+        cur = self.conn.cursor()
+        cur.execute("PRAGMA user_version;")
+        version = cur.fetchone()[0]
+        for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+            with self.conn:
+                # Another process may have opened the DB at the same time,
+                # so check the version again once holding the write lock
+                cur.execute("BEGIN IMMEDIATE;")
+                cur.execute("PRAGMA user_version;")
+                if cur.fetchone()[0] >= number:
+                    continue
+                print(f"Applying DB migration {number}...")
+                for statement in splitStatements(migration):
+                    cur.execute(statement)
+                cur.execute(f"PRAGMA user_version = {number};")
+
+    def addCounterColumns(self):
+        """
+        Add a column for any port counter in the buckets.py registry
+        which the switches & port_history tables don't have yet.
+        Like migrations, these are re-checked under the write lock
+        """
+        if not self.missingCounterColumns():
+            return
+        cur = self.conn.cursor()
+        with self.conn:
+            cur.execute("BEGIN IMMEDIATE;")
+            for table, column, kind in self.missingCounterColumns():
+                print(f"Adding port counter {column} to {table}...")
+                cur.execute(
+                    f"ALTER TABLE {table} ADD COLUMN {column} {kind} DEFAULT 0;"
+                )
+
+    def missingCounterColumns(self):
+        """
+        Find the port counter columns missing from the DB,
+        as (table, column, type) tuples
+        """
+        missing = []
+        cur = self.conn.cursor()
+        for table, kind in (("switches", "integer"), ("port_history", "real")):
+            cur.execute(f"PRAGMA table_info({table});")
+            existing = {row[1] for row in cur.fetchall()}
+            missing.extend(
+                (table, column, kind)
+                for column in HISTORY_COLUMNS
+                if column not in existing
+            )
+        return missing
 
     def addSwitch(self, name, mgmt_ip):
         """
@@ -77,7 +412,56 @@ class DB:
         except sqlite3.IntegrityError:
             print(f"Switch {name} with IP: {mgmt_ip} already exists in DB.")
 
-    def updateSysInfo(self, name, mgmt_ip, sysinfo):
+    def syncSwitches(self, switches, inventory_hash):
+        """
+        Reconcile the switches table with the inventory from config.yml,
+        given as (name, mgmt_ip) tuples. Adds new switches, renames
+        existing ones & deletes the rest in a single transaction.
+        Returns the added & removed management IPs
+        """
+        cur = self.conn.cursor()
+        with self.conn:
+            cur.execute("SELECT name, mgmt_ip FROM switches;")
+            current = dict((mgmt_ip, name) for name, mgmt_ip in cur.fetchall())
+            wanted = dict((mgmt_ip, name) for name, mgmt_ip in switches)
+            added = [ip for ip in wanted if ip not in current]
+            removed = [ip for ip in current if ip not in wanted]
+            renamed = [
+                (wanted[ip], ip)
+                for ip in wanted
+                if ip in current and current[ip] != wanted[ip]
+            ]
+            # Child rows are removed by the switches_delete trigger
+            cur.executemany(
+                "DELETE FROM switches WHERE mgmt_ip = ?;",
+                [(ip,) for ip in removed],
+            )
+            cur.executemany(
+                "INSERT INTO switches(name, mgmt_ip) VALUES (?, ?);",
+                [(wanted[ip], ip) for ip in added],
+            )
+            cur.executemany(
+                "UPDATE switches SET name = ? WHERE mgmt_ip = ?;", renamed
+            )
+            cur.execute(
+                "UPDATE last_update SET inventory_hash = ? WHERE id = 1;",
+                (inventory_hash,),
+            )
+        return added, removed
+
+    def getInventoryHash(self):
+        """
+        Return the hash of the inventory last applied by syncSwitches()
+        """
+        sql = """ SELECT inventory_hash FROM last_update WHERE id = 1; """
+        cur = self.conn.cursor()
+        cur.execute(sql)
+        result = cur.fetchone()
+        if not result:
+            return None
+        return result[0]
+
+    def updateSysInfo(self, name, mgmt_ip, sysinfo, commit=True):
         """
         Update switch system info:
         Model number, software version, and serial number
@@ -90,64 +474,32 @@ class DB:
                   AND mgmt_ip = ?;
         """
         cur = self.conn.cursor()
-        cur.execute(
-            sql, (sysinfo["serial"], sysinfo["model"], sysinfo["sw_ver"], name, mgmt_ip)
-        )
-        self.conn.commit()
+        cur.execute(sql, (sysinfo.serial, sysinfo.model, sysinfo.sw_ver, name, mgmt_ip))
+        if commit:
+            self.conn.commit()
         return
 
-    def updatePorts(self, name, mgmt_ip, portinfo):
+    def updatePorts(self, name, mgmt_ip, portinfo, commit=True):
         """
         Update port count information
         """
-        sql = """ UPDATE switches
-                  SET
-                  total_port = ?,
-                  up_port = ?,
-                  down_port = ?,
-                  disabled_port = ?,
-                  intop10m = ?,
-                  intop100m = ?,
-                  intop1g = ?,
-                  intop10g = ?,
-                  intop25g = ?,
-                  intop40g = ?,
-                  intop100g = ?,
-                  intmedcop = ?,
-                  intmedsfp = ?,
-                  intmedvirt = ?
-                  WHERE name = ?
-                  AND mgmt_ip = ?;
+        columns = ", ".join(f"{col} = ?" for col in portinfo._fields)
+        sql = f""" UPDATE switches
+                   SET {columns}
+                   WHERE name = ?
+                   AND mgmt_ip = ?;
         """
         cur = self.conn.cursor()
-        cur.execute(
-            sql,
-            (
-                portinfo["total_port"],
-                portinfo["up_port"],
-                portinfo["down_port"],
-                portinfo["disabled_port"],
-                portinfo["intop10m"],
-                portinfo["intop100m"],
-                portinfo["intop1g"],
-                portinfo["intop10g"],
-                portinfo["intop25g"],
-                portinfo["intop40g"],
-                portinfo["intop100g"],
-                portinfo["intmedcop"],
-                portinfo["intmedsfp"],
-                portinfo["intmedvirtual"],
-                name,
-                mgmt_ip,
-            ),
-        )
-        self.conn.commit()
+        cur.execute(sql, (*portinfo, name, mgmt_ip))
+        if commit:
+            self.conn.commit()
         return
 
-    def updateInterfaceDetails(self, name, mgmt_ip, sysinfo, portdetails):
+    def updateInterfaceDetails(self, name, mgmt_ip, sysinfo, portdetails, commit=True):
         """
         Update interface detailed status per switch:
         Interface name, operational status, description, and physical address
+        All interfaces are written with a single executemany
         """
         sql = """ INSERT INTO interface_detailed(
                     int_name,
@@ -156,50 +508,329 @@ class DB:
                     phys_address,
                     oper_speed,
                     oper_duplex,
-                    sw_name, 
+                    sw_name,
                     mgmt_ip,
                     serial
                   )
                   VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?)
-                  ON CONFLICT(phys_address) DO UPDATE
-                  SET int_name = ?,
-                  oper_status = ?,
-                  description = ?,
-                  phys_address = ?,
-                  oper_speed = ?,
-                  oper_duplex = ?,
-                  serial = ?
-                  WHERE sw_name = ?
-                  AND mgmt_ip = ?;
+                  ON CONFLICT(mgmt_ip, int_name) DO UPDATE
+                  SET oper_status = excluded.oper_status,
+                  description = excluded.description,
+                  phys_address = excluded.phys_address,
+                  oper_speed = excluded.oper_speed,
+                  oper_duplex = excluded.oper_duplex,
+                  sw_name = excluded.sw_name,
+                  serial = excluded.serial;
         """
+        rows = [
+            (*interface, name, mgmt_ip, sysinfo.serial) for interface in portdetails
+        ]
         cur = self.conn.cursor()
-        for interface in portdetails:
-            cur.execute(
-                sql,
-                (
-                    interface,
-                    portdetails[interface]["oper_status"],
-                    portdetails[interface]["description"],
-                    portdetails[interface]["phys_addr"],
-                    portdetails[interface]["oper_speed"],
-                    portdetails[interface]["oper_duplex"],
-                    name,
-                    mgmt_ip,
-                    sysinfo["serial"],
-                    interface,
-                    portdetails[interface]["oper_status"],
-                    portdetails[interface]["description"],
-                    portdetails[interface]["phys_addr"],
-                    portdetails[interface]["oper_speed"],
-                    portdetails[interface]["oper_duplex"],
-                    sysinfo["serial"],
-                    name,
-                    mgmt_ip,
-                ),
+        cur.executemany(sql, rows)
+        if commit:
+            self.conn.commit()
+        return
+
+    def syncInterfaceDetails(
+        self, name, mgmt_ip, sysinfo, portdetails, fingerprint, commit=True, force=False
+    ):
+        """
+        Write only the interfaces that changed since the last poll,
+        and remove interfaces that no longer exist on the switch.
+        If the fingerprint matches the last interface set written,
+        nothing is touched at all, unless forced.
+        Returns the number of interface rows changed
+        """
+        cur = self.conn.cursor()
+        sql = """ SELECT int_fingerprint FROM switches WHERE mgmt_ip = ?; """
+        cur.execute(sql, [mgmt_ip])
+        row = cur.fetchone()
+        if row and row[0] == fingerprint and not force:
+            return 0
+        sql = """ SELECT int_name, oper_status, description, phys_address,
+                  oper_speed, oper_duplex, serial, sw_name
+                  FROM interface_detailed WHERE mgmt_ip = ?; """
+        cur.execute(sql, [mgmt_ip])
+        existing = {row[0]: row for row in cur.fetchall()}
+        changed = [
+            interface
+            for interface in portdetails
+            if existing.get(interface.int_name) != (*interface, sysinfo.serial, name)
+        ]
+        current = {interface.int_name for interface in portdetails}
+        removed = [[mgmt_ip, iface] for iface in existing if iface not in current]
+        self.updateInterfaceDetails(name, mgmt_ip, sysinfo, changed, commit=False)
+        sql = """ DELETE FROM interface_detailed
+                  WHERE mgmt_ip = ? AND int_name = ?; """
+        cur.executemany(sql, removed)
+        sql = """ UPDATE switches SET int_fingerprint = ? WHERE mgmt_ip = ?; """
+        cur.execute(sql, (fingerprint, mgmt_ip))
+        if commit:
+            self.conn.commit()
+        return len(changed) + len(removed)
+
+    def updateDevice(
+        self,
+        name,
+        mgmt_ip,
+        sysinfo,
+        portinfo,
+        portdetails,
+        fingerprint,
+        polled=True,
+        polled_at=None,
+    ):
+        """
+        Write everything collected from one poll of a switch:
+        system info, port counts, interface details & check status.
+        All updates are committed together in a single transaction.
+        Data re-parsed from stored output (polled=False) skips the
+        port history & check status, and always re-checks every interface.
+        Returns the number of interface rows changed
+        """
+        with self.conn:
+            self.updateSysInfo(name, mgmt_ip, sysinfo, commit=False)
+            self.updatePorts(name, mgmt_ip, portinfo, commit=False)
+            if polled:
+                self.addHistory(mgmt_ip, commit=False)
+            changes = self.syncInterfaceDetails(
+                name,
+                mgmt_ip,
+                sysinfo,
+                portdetails,
+                fingerprint,
+                commit=False,
+                force=not polled,
             )
+            if polled:
+                self.updateStatus(name, mgmt_ip, True, commit=False)
+                self.updateLastPoll(mgmt_ip, polled_at, commit=False)
+        return changes
+
+    def addHistory(self, mgmt_ip, commit=True):
+        """
+        Record the switch's current port counts in port_history
+        """
+        columns = ", ".join(HISTORY_COLUMNS)
+        sql = f""" INSERT OR REPLACE INTO port_history
+                   (mgmt_ip, period, ts, {columns})
+                   SELECT mgmt_ip, 'raw', ?, {columns}
+                   FROM switches WHERE mgmt_ip = ?; """
+        cur = self.conn.cursor()
+        cur.execute(sql, (int(time.time()), mgmt_ip))
+        if commit:
             self.conn.commit()
         return
 
+    def rollupHistory(self, raw_hours, hourly_days, daily_days):
+        """
+        Roll up completed hours of raw samples into hourly averages,
+        and completed days of hourly averages into daily averages.
+        Then purge anything older than its retention period
+        """
+        now = int(time.time())
+        averages = ", ".join(
+            f"SUM({col} * samples) / SUM(samples)" for col in HISTORY_COLUMNS
+        )
+        columns = ", ".join(HISTORY_COLUMNS)
+        cur = self.conn.cursor()
+        with self.conn:
+            for source, period in (("raw", "hour"), ("hour", "day")):
+                size = HISTORY_PERIODS[period]
+                # Re-aggregate from the newest existing bucket onwards,
+                # but only buckets which are already complete
+                sql = f""" INSERT OR REPLACE INTO port_history
+                           (mgmt_ip, period, ts, samples, {columns})
+                           SELECT mgmt_ip, ?, ts - ts % ?, SUM(samples),
+                           {averages}
+                           FROM port_history
+                           WHERE period = ? AND ts < ?
+                           AND ts >= (SELECT COALESCE(MAX(ts), 0)
+                                      FROM port_history WHERE period = ?)
+                           GROUP BY mgmt_ip, ts - ts % ?; """
+                cur.execute(
+                    sql, (period, size, source, now - now % size, period, size)
+                )
+            # Cutoffs are aligned to bucket boundaries, so a bucket is
+            # never rolled up from a partially purged set of samples
+            sql = """ DELETE FROM port_history WHERE period = ? AND ts < ?; """
+            for period, cutoff, size in (
+                ("raw", now - raw_hours * 3600, 3600),
+                ("hour", now - hourly_days * 86400, 86400),
+                ("day", now - daily_days * 86400, 1),
+            ):
+                cur.execute(sql, (period, cutoff - cutoff % size))
+        return
+
+    def getSwitchHistory(self, serial, period="hour", since=0):
+        """
+        Retrieve port count history for one switch,
+        at 'raw', 'hour' or 'day' resolution
+        """
+        columns = ", ".join(f"h.{col}" for col in HISTORY_COLUMNS)
+        sql = f""" SELECT h.ts, h.samples, {columns}
+                   FROM port_history h JOIN switches s ON h.mgmt_ip = s.mgmt_ip
+                   WHERE s.serial = ? AND h.period = ? AND h.ts >= ?
+                   ORDER BY h.ts; """
+        cur = self.conn.cursor()
+        cur.execute(sql, (serial, period, since))
+        result = cur.fetchall()
+        return result
+
+    def getNetworkHistory(self, period="hour", since=0):
+        """
+        Retrieve network-wide port count history,
+        summed across all switches at 'hour' or 'day' resolution
+        """
+        columns = ", ".join(f"SUM({col})" for col in HISTORY_COLUMNS)
+        sql = f""" SELECT ts, COUNT(*), {columns}
+                   FROM port_history WHERE period = ? AND ts >= ?
+                   GROUP BY ts ORDER BY ts; """
+        cur = self.conn.cursor()
+        cur.execute(sql, (period, since))
+        result = cur.fetchall()
+        return result
+
+    def addDeviceTimings(self, timings):
+        """
+        Record the per-stage timings of completed polls,
+        given as (mgmt_ip, unix time, {stage: seconds}) tuples.
+        Only the latest poll of each switch is kept
+        """
+        columns = ", ".join(TIMING_STAGES)
+        params = ", ".join("?" for stage in TIMING_STAGES)
+        sql = f""" INSERT OR REPLACE INTO device_timings (mgmt_ip, ts, {columns})
+                   VALUES (?, ?, {params}); """
+        rows = [
+            (mgmt_ip, ts, *(stages.get(stage, 0) for stage in TIMING_STAGES))
+            for mgmt_ip, ts, stages in timings
+        ]
+        with self.conn:
+            self.conn.executemany(sql, rows)
+        return
+
+    def addSweepTiming(self, duration, devices, succeeded):
+        """
+        Record how long a full collector sweep took,
+        dropping the oldest beyond SWEEP_HISTORY
+        """
+        sql = """ INSERT OR REPLACE INTO sweep_timings
+                  (ts, duration, devices, succeeded) VALUES (?, ?, ?, ?); """
+        purge = """ DELETE FROM sweep_timings WHERE ts NOT IN
+                    (SELECT ts FROM sweep_timings ORDER BY ts DESC LIMIT ?); """
+        cur = self.conn.cursor()
+        with self.conn:
+            cur.execute(sql, (time.time(), duration, devices, succeeded))
+            cur.execute(purge, (SWEEP_HISTORY,))
+        return
+
+    def getDeviceTimings(self):
+        """
+        Retrieve the latest per-stage poll timings of every switch
+        """
+        columns = ", ".join(f"t.{stage}" for stage in TIMING_STAGES)
+        sql = f""" SELECT s.name, s.mgmt_ip, t.ts, {columns}
+                   FROM device_timings t JOIN switches s ON t.mgmt_ip = s.mgmt_ip
+                   ORDER BY s.name; """
+        cur = self.conn.cursor()
+        cur.execute(sql)
+        result = cur.fetchall()
+        return result
+
+    def getSweepTimings(self, limit=1):
+        """
+        Retrieve the most recent full collector sweeps, newest first
+        """
+        sql = """ SELECT ts, duration, devices, succeeded FROM sweep_timings
+                  ORDER BY ts DESC LIMIT ?; """
+        cur = self.conn.cursor()
+        cur.execute(sql, (limit,))
+        result = cur.fetchall()
+        return result
+
+    def addCapture(self, serial, digest, codec, size, keep):
+        """
+        Index a new raw output capture for a switch, dropping the oldest
+        beyond 'keep'. Objects of dropped captures are queued in
+        raw_orphans, see takeOrphans()
+        """
+        now = time.time()
+        insert = """ INSERT OR REPLACE INTO raw_captures
+                     (serial, first_seen, last_seen, digest, codec, size)
+                     VALUES (?, ?, ?, ?, ?, ?); """
+        expired = """ SELECT first_seen, digest, codec FROM raw_captures
+                      WHERE serial = ? ORDER BY first_seen DESC LIMIT -1 OFFSET ?; """
+        delete = """ DELETE FROM raw_captures WHERE serial = ? AND first_seen = ?; """
+        cur = self.conn.cursor()
+        with self.conn:
+            cur.execute(insert, (serial, now, now, digest, codec, size))
+            cur.execute(expired, (serial, max(keep, 1)))
+            old = cur.fetchall()
+            cur.executemany(delete, [(serial, first_seen) for first_seen, *_ in old])
+        return
+
+    def takeOrphans(self):
+        """
+        Empty the raw_orphans queue. Returns (digest, codec) of each
+        queued object no longer referenced by any capture, so it can be removed
+        """
+        sql = """ SELECT o.digest, o.codec FROM raw_orphans o
+                  WHERE NOT EXISTS (SELECT 1 FROM raw_captures c
+                  WHERE c.digest = o.digest AND c.codec = o.codec); """
+        cur = self.conn.cursor()
+        with self.conn:
+            cur.execute(sql)
+            result = cur.fetchall()
+            cur.execute("DELETE FROM raw_orphans;")
+        return result
+
+    def touchCapture(self, serial, first_seen):
+        """
+        Mark a switch's capture as seen again, when the same output is returned
+        """
+        sql = """ UPDATE raw_captures SET last_seen = ?
+                  WHERE serial = ? AND first_seen = ?; """
+        with self.conn:
+            self.conn.execute(sql, (time.time(), serial, first_seen))
+        return
+
+    def getLatestCapture(self, serial):
+        """
+        Retrieve (digest, codec, first_seen, last_seen) of the
+        latest raw output capture for a switch, or None
+        """
+        sql = """ SELECT digest, codec, first_seen, last_seen FROM raw_captures
+                  WHERE serial = ? ORDER BY first_seen DESC LIMIT 1; """
+        cur = self.conn.cursor()
+        cur.execute(sql, (serial,))
+        result = cur.fetchone()
+        return result
+
+    def getLastCaptures(self):
+        """
+        Retrieve when raw output was last archived for each switch,
+        as {mgmt_ip: unix time}
+        """
+        sql = """ SELECT s.mgmt_ip, MAX(c.last_seen)
+                  FROM switches s JOIN raw_captures c ON c.serial = s.serial
+                  GROUP BY s.mgmt_ip; """
+        cur = self.conn.cursor()
+        cur.execute(sql)
+        result = dict(cur.fetchall())
+        return result
+
+    def getLastPolls(self):
+        """
+        Retrieve when each switch's latest successful poll
+        was collected, as {mgmt_ip: unix time}
+        """
+        sql = """ SELECT mgmt_ip, last_poll FROM switches
+                  WHERE last_poll IS NOT NULL; """
+        cur = self.conn.cursor()
+        cur.execute(sql)
+        result = dict(cur.fetchall())
+        return result
+
     def getSwitch(self, name, mgmt_ip):
         """
         Retrieve switch information
@@ -224,14 +855,29 @@ class DB:
 
     def getNetworkWideStats(self):
         """
-        Retrieve network-wide port count information
+        Retrieve network-wide port count totals,
+        summed across all switches
         """
-        sql = """ SELECT model, sw_ver, total_port, up_port, down_port,
-                  disabled_port, intop10m, intop100m, intop1g, intop10g,
-                  intop25g, intop40g, intop100g,intmedcop, intmedsfp,
-                  intmedvirt FROM switches; """
+        columns = ", ".join(f"COALESCE(SUM({col}), 0)" for col in HISTORY_COLUMNS)
+        sql = f""" SELECT {columns} FROM switches; """
         cur = self.conn.cursor()
+        cur.row_factory = rowFactory(PortCounts)
         cur.execute(sql)
+        result = cur.fetchone()
+        return result
+
+    def getMostCommon(self, column, limit=5):
+        """
+        Retrieve the most common hardware models or software versions,
+        with the number of switches for each
+        """
+        if column not in ("model", "sw_ver"):
+            raise ValueError(f"Unsupported column: {column}")
+        sql = f""" SELECT {column}, COUNT(*) FROM switches
+                   WHERE {column} NOT LIKE '%N/A%'
+                   GROUP BY {column} ORDER BY COUNT(*) DESC LIMIT ?; """
+        cur = self.conn.cursor()
+        cur.execute(sql, [limit])
         result = cur.fetchall()
         return result
 
@@ -247,29 +893,160 @@ class DB:
         result = cur.fetchall()
         return result
 
+    def getPolledSwitches(self):
+        """
+        Retrieve summaries of every switch polled at least once
+        """
+        sql = f""" SELECT name, serial, model, sw_ver, mgmt_ip, last_check,
+                   total_port, up_port, down_port, disabled_port, {CAPACITY_SQL}
+                   FROM switches WHERE serial != 'Not Polled Yet'; """
+        cur = self.conn.cursor()
+        cur.row_factory = rowFactory(SwitchSummary)
+        cur.execute(sql)
+        result = cur.fetchall()
+        return result
+
+    def querySwitches(
+        self,
+        sort="name",
+        descending=False,
+        limit=100,
+        after=None,
+        status=None,
+        model=None,
+        min_capacity=None,
+        max_capacity=None,
+        prefix=None,
+    ):
+        """
+        Retrieve one page of switch summaries, sorted & filtered.
+        Pages are keyed on (sort value, mgmt_ip) of the last row seen,
+        passed back in as 'after' to fetch the next page
+        """
+        sortcol = SWITCH_EXPRESSIONS.get(SWITCH_SORTS[sort], SWITCH_SORTS[sort])
+        where = []
+        params = []
+        if status is not None:
+            where.append("last_check = ?")
+            params.append(status)
+        if model is not None:
+            where.append("model = ?")
+            params.append(model)
+        if min_capacity is not None:
+            where.append(f"{CAPACITY_SQL} >= ?")
+            params.append(min_capacity)
+        if max_capacity is not None:
+            where.append(f"{CAPACITY_SQL} <= ?")
+            params.append(max_capacity)
+        if prefix:
+            where.append("substr(name, 1, ?) = ?")
+            params.extend([len(prefix), prefix])
+        if after is not None:
+            where.append(f"({sortcol}, mgmt_ip) {'<' if descending else '>'} (?, ?)")
+            params.extend(after)
+        order = "DESC" if descending else "ASC"
+        sql = f""" SELECT name, serial, model, sw_ver, mgmt_ip, last_check,
+                   total_port, up_port, down_port, disabled_port, {CAPACITY_SQL}
+                   FROM switches
+                   {"WHERE " + " AND ".join(where) if where else ""}
+                   ORDER BY {sortcol} {order}, mgmt_ip {order}
+                   LIMIT ?; """
+        params.append(limit)
+        cur = self.conn.cursor()
+        cur.row_factory = rowFactory(SwitchSummary)
+        cur.execute(sql, params)
+        result = cur.fetchall()
+        return result
+
+    def queryInterfaces(
+        self,
+        serial,
+        sort="port",
+        descending=False,
+        limit=100,
+        after=None,
+        status=None,
+        prefix=None,
+    ):
+        """
+        Retrieve one page of interface details for a switch, sorted & filtered.
+        Pages are keyed on (sort value, int_name) of the last row seen,
+        passed back in as 'after' to fetch the next page
+        """
+        sortcol = INTERFACE_SORTS[sort]
+        sortvalue = "?"
+        if sort in INTERFACE_FUNCTIONS:
+            # The cursor holds the column's value, so it needs the function too
+            sortcol = f"{INTERFACE_FUNCTIONS[sort]}({sortcol})"
+            sortvalue = f"{INTERFACE_FUNCTIONS[sort]}(?)"
+        where = ["serial = ?"]
+        params = [serial]
+        if status is not None:
+            where.append("oper_status = ?")
+            params.append(status)
+        if prefix:
+            where.append("substr(int_name, 1, ?) = ?")
+            params.extend([len(prefix), prefix])
+        if after is not None:
+            where.append(
+                f"({sortcol}, int_name) {'<' if descending else '>'} ({sortvalue}, ?)"
+            )
+            params.extend(after)
+        order = "DESC" if descending else "ASC"
+        sql = f""" SELECT int_name, oper_status, description, phys_address,
+                   oper_speed, oper_duplex
+                   FROM interface_detailed
+                   WHERE {" AND ".join(where)}
+                   ORDER BY {sortcol} {order}, int_name {order}
+                   LIMIT ?; """
+        params.append(limit)
+        cur = self.conn.cursor()
+        cur.row_factory = rowFactory(Interface)
+        cur.execute(sql, params)
+        result = cur.fetchall()
+        return result
+
     def getSwitchDetail(self, serial):
         """
-        Retrieve info from ALL switches in DB.
+        Retrieve everything about one switch,
+        or None if there's no switch with that serial
         """
-        sql = """ SELECT * FROM switches WHERE serial = ?; """
+        columns = ", ".join(HISTORY_COLUMNS)
+        sql = f""" SELECT name, serial, model, sw_ver, mgmt_ip, last_check,
+                   {columns}, CAST({CAPACITY_SQL} AS integer)
+                   FROM switches WHERE serial = ?; """
         cur = self.conn.cursor()
+        cur.row_factory = rowFactory(SwitchDetail)
         cur.execute(sql, [serial])
-        result = cur.fetchall()
+        result = cur.fetchone()
         return result
 
     def getInterfaceDetail(self, serial):
         """
         Retrieve interface detailed info
         """
-        sql = """ SELECT int_name, description, phys_address, oper_status,
+        sql = """ SELECT int_name, oper_status, description, phys_address,
                   oper_speed, oper_duplex
                   FROM interface_detailed WHERE serial = ? """
         cur = self.conn.cursor()
+        cur.row_factory = rowFactory(Interface)
         cur.execute(sql, [serial])
         result = cur.fetchall()
         return result
 
-    def updateStatus(self, name, mgmt_ip, status):
+    def getInterfaceAddresses(self, mgmt_ip):
+        """
+        Retrieve the MAC address of each interface on a switch,
+        as {int_name: phys_address}
+        """
+        sql = """ SELECT int_name, phys_address FROM interface_detailed
+                  WHERE mgmt_ip = ?; """
+        cur = self.conn.cursor()
+        cur.execute(sql, [mgmt_ip])
+        result = dict(cur.fetchall())
+        return result
+
+    def updateStatus(self, name, mgmt_ip, status, commit=True):
         """
         Update only the last_check column with
         whether or not the last polling succeeded
@@ -278,25 +1055,66 @@ class DB:
                   WHERE name = ? AND mgmt_ip = ?; """
         cur = self.conn.cursor()
         cur.execute(sql, (status, name, mgmt_ip))
-        self.conn.commit()
-        print("DB Update completed")
+        if commit:
+            self.conn.commit()
+            print("DB Update completed")
+        return
+
+    def updateLastPoll(self, mgmt_ip, polled_at, commit=True):
+        """
+        Record when the data from a switch's
+        latest successful poll was collected
+        """
+        sql = """ UPDATE switches SET last_poll = ? WHERE mgmt_ip = ?; """
+        cur = self.conn.cursor()
+        cur.execute(sql, (polled_at, mgmt_ip))
+        if commit:
+            self.conn.commit()
         return
 
     def updateLastRun(self):
         """
-        Updates single entry that contains last run time
+        Updates single entry that contains last run time,
+        and bumps the sweep generation number
         """
         sql = """ UPDATE last_update
-                  SET lastrun = ?
+                  SET lastrun = ?,
+                  lastrun_ts = ?,
+                  generation = generation + 1
                   WHERE id = 1;
         """
         now = datetime.now()
         timestamp = now.strftime("%B, %d, %Y %H:%M:%S")
         cur = self.conn.cursor()
-        cur.execute(sql, [timestamp])
+        cur.execute(sql, (timestamp, now.timestamp()))
+        self.conn.commit()
+        return
+
+    def bumpGeneration(self):
+        """
+        Mark the dashboard's cached pages as stale,
+        without changing the last run time
+        """
+        sql = """ UPDATE last_update SET generation = generation + 1 WHERE id = 1; """
+        cur = self.conn.cursor()
+        cur.execute(sql)
         self.conn.commit()
         return
 
+    def getGeneration(self):
+        """
+        Return the current sweep generation number
+        & the unix time of the last run
+        """
+        sql = """ SELECT generation, lastrun_ts FROM last_update WHERE id = 1;
+        """
+        cur = self.conn.cursor()
+        cur.execute(sql)
+        result = cur.fetchone()
+        if not result:
+            return 0, None
+        return result
+
     def getLastUpdate(self):
         """
         Return last runtime
@@ -1,53 +1,299 @@
-from collections import Counter
+import base64
+import functools
+import json
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from itertools import islice
 
-from flask import Flask, render_template
+from flask import (
+    Flask,
+    abort,
+    g,
+    jsonify,
+    make_response,
+    render_template,
+    request,
+    send_file,
+    stream_with_context,
+)
 from flask_bootstrap import Bootstrap
 
+import buckets
+import rawstore
 import switchdb
 
 
 app = Flask(__name__)
 
+# Rendered pages keyed by request path, each tagged with the
+# collector sweep generation it was rendered from
+CACHE_SIZE = 512
+_cache = {}
+# Included in ETags so a restart (e.g. new templates) invalidates browser caches
+_started = int(time.time())
+# Max lines of raw output returned per page
+RAW_PAGE_SIZE = 1000
+# Max rows returned per page by the JSON API
+API_PAGE_SIZE = 500
+# Upper bounds, in seconds, of the request latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Request latency histograms keyed by (endpoint, method, status),
+# each holding per-bucket counts, then the sum & count of all requests
+_latency = {}
+_latency_lock = threading.Lock()
+
+
+def getDB():
+    """
+    Borrow a pooled DB connection for the current request.
+    The same connection is reused for every query in the request
+    """
+    if "db" not in g:
+        g.db = switchdb.acquireDB()
+    return g.db
+
+
+@app.context_processor
+def portBuckets():
+    """
+    Make the port speed & media counters from buckets.py
+    available to every template, as (column, label) pairs
+    """
+    return {"speeds": buckets.SPEED_LABELS, "media": buckets.MEDIA_LABELS}
+
+
+@app.teardown_appcontext
+def releaseDB(exception):
+    """
+    Hand the request's DB connection back to the pool
+    """
+    swDB = g.pop("db", None)
+    if swDB is not None:
+        switchdb.releaseDB(swDB)
+
+
+@app.before_request
+def startTimer():
+    """
+    Note when the request started, for the latency metrics
+    """
+    g.started = time.perf_counter()
+
+
+@app.after_request
+def recordLatency(response):
+    """
+    Add the request's latency to its histogram
+    """
+    if "started" not in g:
+        return response
+    elapsed = time.perf_counter() - g.started
+    key = (request.endpoint or "none", request.method, str(response.status_code))
+    with _latency_lock:
+        histogram = _latency.setdefault(key, [0] * (len(LATENCY_BUCKETS) + 2))
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if elapsed <= bound:
+                histogram[index] += 1
+        histogram[-2] += elapsed
+        histogram[-1] += 1
+    return response
+
+
+def cached(view):
+    """
+    Serve a route from the response cache until the collector
+    finishes another sweep. Responses carry an ETag & Last-Modified,
+    so browsers revalidating with a conditional GET receive a 304
+    """
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        generation, lastrun = getDB().getGeneration()
+        key = request.full_path
+        entry = _cache.get(key)
+        if entry is None or entry[0] != generation:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            if len(_cache) >= CACHE_SIZE:
+                _cache.clear()
+            entry = (generation, response.get_data(), response.mimetype)
+            _cache[key] = entry
+        response = app.response_class(entry[1], mimetype=entry[2])
+        response.set_etag(f"{_started}-{generation}")
+        if lastrun:
+            response.last_modified = datetime.fromtimestamp(lastrun, timezone.utc)
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
+
+    return wrapper
+
 
 @app.route("/", methods=["GET"])
+@cached
 def switch_inventory():
     """
     Main web page, displays summary statistics of all switches
     """
     lastupdate = getLastUpdate()
-    switchdata = getSwitchInfo()
-    return render_template("main.html", switches=switchdata, lastupdate=lastupdate)
+    return render_template("main.html", lastupdate=lastupdate)
 
 
 @app.route("/<serial>", methods=["GET"])
+@cached
 def switch_info(serial):
     """
     This page shows detailed stats on an individual switch
     queried by serial number
     """
     detail = getSwitchDetail(serial)
-    intdetail = getInterfaceDetail(serial)
-    try:
-        raw_data = open(f"raw_output/{serial}.txt", "r").read().splitlines()
-    except:
-        raw_data = "None collected yet"
+    if detail is None:
+        abort(404)
     return render_template(
-        "detail.html",
-        title=serial,
-        switch=detail,
-        interfaces=intdetail,
-        raw_data=raw_data,
+        "detail.html", title=serial, switch=detail, capture=getRawCapture(serial)
+    )
+
+
+@app.route("/api/switches", methods=["GET"])
+@cached
+def api_switches():
+    """
+    Returns a page of switch summaries as JSON
+    Query params: sort, order (asc / desc), limit, after (cursor from the
+    previous page), status (success / failed), model, min_capacity,
+    max_capacity, prefix (switch name)
+    """
+    query = pageQuery(switchdb.SWITCH_SORTS)
+    status = request.args.get("status")
+    if status:
+        query["status"] = status == "success"
+    query["model"] = request.args.get("model") or None
+    query["min_capacity"] = request.args.get("min_capacity", type=float)
+    query["max_capacity"] = request.args.get("max_capacity", type=float)
+    switches, cursor = getSwitchInfo(**query)
+    items = [switch._asdict() for switch in switches]
+    return jsonify({"items": items, "next": cursor})
+
+
+@app.route("/api/switches/<serial>/interfaces", methods=["GET"])
+@cached
+def api_interfaces(serial):
+    """
+    Returns a page of interface details for one switch as JSON
+    Query params: sort, order (asc / desc), limit, after (cursor from the
+    previous page), status (up / down), prefix (interface name)
+    """
+    # Ports are listed in port order unless sorted otherwise
+    query = pageQuery(switchdb.INTERFACE_SORTS, default="port")
+    query["status"] = request.args.get("status") or None
+    interfaces, cursor = getInterfaceDetail(serial, **query)
+    items = [interface._asdict() for interface in interfaces]
+    return jsonify({"items": items, "next": cursor})
+
+
+@app.route("/<serial>/raw", methods=["GET"])
+def switch_raw(serial):
+    """
+    Returns raw CLI output collected from a switch.
+    With 'start' / 'count' query params, returns a page of lines as JSON,
+    used by the detail page to load output on demand.
+    Otherwise streams the whole capture as plain text
+    """
+    path, codec = findRawOutput(serial)
+    if not path:
+        abort(404)
+    if "start" in request.args or "count" in request.args:
+        start = max(request.args.get("start", 0, type=int), 0)
+        count = request.args.get("count", RAW_PAGE_SIZE, type=int)
+        count = min(max(count, 1), RAW_PAGE_SIZE)
+        with rawstore.openCapture(path, codec) as raw:
+            # Read one extra line to find out if there's more to come
+            page = islice(raw, start, start + count + 1)
+            lines = [line.rstrip("\n") for line in page]
+        more = len(lines) > count
+        return jsonify(
+            {"lines": lines[:count], "next": start + count if more else None}
+        )
+    if not codec:
+        # Supports conditional & range requests
+        return send_file(path, mimetype="text/plain", conditional=True)
+    if codec in request.accept_encodings:
+        # Hand the compressed file straight to the browser
+        response = send_file(path, mimetype="text/plain", conditional=False)
+        response.headers["Content-Encoding"] = codec
+        response.vary.add("Accept-Encoding")
+        return response
+
+    def generate():
+        with rawstore.openCapture(path, codec) as raw:
+            while True:
+                chunk = raw.read(64 * 1024)
+                if not chunk:
+                    break
+                yield chunk
+
+    response = app.response_class(
+        stream_with_context(generate()), mimetype="text/plain"
     )
+    # The body depends on Accept-Encoding, so caches mustn't mix them up
+    response.vary.add("Accept-Encoding")
+    return response
 
 
 @app.route("/network-wide", methods=["GET"])
+@cached
 def network_wide():
     """
     This page shows a summary of all port counts, etc
     across the entire network
     """
-    network = getNetworkWide()
-    return render_template("network-wide.html", network=network)
+    network, models, swvers = getNetworkWide()
+    return render_template(
+        "network-wide.html", network=network, models=models, swvers=swvers
+    )
+
+
+@app.route("/network-wide/history", methods=["GET"])
+@cached
+def network_history():
+    """
+    Returns network-wide port count trends as JSON
+    Optional query params: period (hour / day), since (unix time)
+    """
+    period = request.args.get("period", "hour")
+    if period not in switchdb.HISTORY_PERIODS:
+        abort(400)
+    since = request.args.get("since", 0, type=int)
+    return jsonify(getNetworkHistory(period, since))
+
+
+@app.route("/<serial>/history", methods=["GET"])
+@cached
+def switch_history(serial):
+    """
+    Returns port count trends for a single switch as JSON
+    Optional query params: period (raw / hour / day), since (unix time)
+    """
+    period = request.args.get("period", "hour")
+    if period != "raw" and period not in switchdb.HISTORY_PERIODS:
+        abort(400)
+    since = request.args.get("since", 0, type=int)
+    return jsonify(getSwitchHistory(serial, period, since))
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """
+    Collector timings & dashboard request latency,
+    in the Prometheus text exposition format
+    """
+    lines = getCollectorMetrics() + getRequestMetrics()
+    response = make_response("\n".join(lines) + "\n")
+    response.mimetype = "text/plain"
+    response.headers["Content-Type"] = "text/plain; version=0.0.4; charset=utf-8"
+    return response
 
 
 @app.route("/lastupdate", methods=["GET"])
@@ -56,39 +302,51 @@ def getLastUpdate():
     Check DB for last runtime of backend script
     This is published on the main page to see when stats were last updated
     """
-    swDB = switchdb.DB()
+    swDB = getDB()
     lastupdate = swDB.getLastUpdate()
-    swDB.close()
     return lastupdate
 
 
-def getSwitchInfo():
+def findRawOutput(serial):
+    """
+    Locate the latest stored raw output for a switch.
+    Returns the file path & its compression codec (None if uncompressed)
     """
-    Query DB for summary info on all
+    found = rawstore.latest(getDB(), serial)
+    if found is None:
+        return None, None
+    path, codec = found
+    return os.path.abspath(path), codec
+
+
+def getRawCapture(serial):
+    """
+    When the latest raw output for a switch was first & last collected,
+    formatted for display. None if nothing is archived
+    """
+    capture = getDB().getLatestCapture(serial)
+    if capture is None:
+        return None
+    first_seen, last_seen = (
+        datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M:%S") for ts in capture[2:]
+    )
+    return {"first_seen": first_seen, "last_seen": last_seen}
+
+
+def getSwitchInfo(limit, **query):
+    """
+    Query DB for one page of summary info on
     switches currently monitored
+    Returns the switches & a cursor for the next page
     """
-    swDB = switchdb.DB()
-    raw_info = swDB.getAllSummary()
-    switchList = []
-    for row in raw_info:
-        row = list(row)
-        switch = {}
-        switch["name"] = row[0]
-        switch["serial"] = row[1]
-        switch["swver"] = row[2]
-        switch["ip"] = row[3]
-        switch["check"] = row[4]
-        switch["total"] = row[5]
-        switch["up"] = row[6]
-        switch["down"] = row[7]
-        switch["disabled"] = row[8]
-        if switch["total"] == 0:
-            switch["capacity"] = 0
-        else:
-            switch["capacity"] = (switch["up"] / switch["total"]) * 100
-        switchList.append(switch)
-    swDB.close()
-    return switchList
+    swDB = getDB()
+    switches = swDB.querySwitches(limit=limit + 1, **query)
+    cursor = None
+    if len(switches) > limit:
+        last = switches[limit - 1]
+        sortvalue = getattr(last, switchdb.SWITCH_SORTS[query["sort"]])
+        cursor = encodeCursor(sortvalue, last.mgmt_ip)
+    return switches[:limit], cursor
 
 
 def getSwitchDetail(serial):
@@ -96,119 +354,212 @@ def getSwitchDetail(serial):
     Query DB for details on one specific device
     by serial number
     """
-    swDB = switchdb.DB()
-    raw_info = swDB.getSwitchDetail(serial)
-    switch = {}
-    for row in raw_info:
-        switch["name"] = row[0]
-        switch["serial"] = row[1]
-        switch["model"] = row[2]
-        switch["swver"] = row[3]
-        switch["ip"] = row[4]
-        switch["check"] = row[5]
-        switch["total"] = row[6]
-        switch["up"] = row[7]
-        switch["down"] = row[8]
-        switch["disabled"] = row[9]
-        switch["int10m"] = row[10]
-        switch["int100m"] = row[11]
-        switch["int1g"] = row[12]
-        switch["int10g"] = row[13]
-        switch["int25g"] = row[14]
-        switch["int40g"] = row[15]
-        switch["int100g"] = row[16]
-        switch["copper"] = row[17]
-        switch["sfp"] = row[18]
-        switch["virtual"] = row[19]
-        if switch["total"] == 0:
-            switch["capacity"] = 0
-        else:
-            switch["capacity"] = int((switch["up"] / switch["total"]) * 100)
-    swDB.close()
-    return switch
-
-
-def getInterfaceDetail(serial):
-    """
-    Query DB for interface details on one specific device
-    by management IP
-    """
-    swDB = switchdb.DB()
-    raw_info = swDB.getInterfaceDetail(serial)
-    interfaceList = []
-    for row in raw_info:
-        row = list(row)
-        interface = {}
-        interface["name"] = row[0]
-        interface["description"] = row[1]
-        interface["physical_address"] = row[2]
-        interface["oper_status"] = row[3]
-        interface["oper_speed"] = row[4]
-        interface["oper_duplex"] = row[5]
-        interfaceList.append(interface)
-    return interfaceList
+    swDB = getDB()
+    return swDB.getSwitchDetail(serial)
 
 
-def getNetworkWide():
+def getInterfaceDetail(serial, limit, **query):
+    """
+    Query DB for one page of interface details
+    on one specific device by serial number
+    Returns the interfaces & a cursor for the next page
     """
-    Query DB for all switch statistcs,
-    then tally results & return to web page
-    """
-    swDB = switchdb.DB()
-    result = swDB.getNetworkWideStats()
-    swDB.close()
-    network = {
-        "models": [],
-        "swvers": [],
-        "total": 0,
-        "up": 0,
-        "down": 0,
-        "disabled": 0,
-        "int10m": 0,
-        "int100m": 0,
-        "int1g": 0,
-        "int10g": 0,
-        "int25g": 0,
-        "int40g": 0,
-        "int100g": 0,
-        "copper": 0,
-        "sfp": 0,
-        "virtual": 0,
+    swDB = getDB()
+    interfaces = swDB.queryInterfaces(serial, limit=limit + 1, **query)
+    cursor = None
+    if len(interfaces) > limit:
+        last = interfaces[limit - 1]
+        sortvalue = getattr(last, switchdb.INTERFACE_SORTS[query["sort"]])
+        cursor = encodeCursor(sortvalue, last.int_name)
+    return interfaces[:limit], cursor
+
+
+def encodeCursor(sortvalue, key):
+    """
+    Build an opaque pagination cursor from the last row of a page
+    """
+    cursor = json.dumps([sortvalue, key]).encode()
+    return base64.urlsafe_b64encode(cursor).decode()
+
+
+def decodeCursor(cursor):
+    """
+    Unpack a pagination cursor from encodeCursor()
+    """
+    try:
+        sortvalue, key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (TypeError, ValueError):
+        abort(400)
+    return sortvalue, key
+
+
+def pageQuery(sorts, default="name"):
+    """
+    Read sort & pagination params shared by the JSON API routes
+    """
+    sort = request.args.get("sort", default)
+    if sort not in sorts:
+        abort(400)
+    query = {
+        "sort": sort,
+        "descending": request.args.get("order", "asc") == "desc",
+        "limit": min(max(request.args.get("limit", 100, type=int), 1), API_PAGE_SIZE),
+        "prefix": request.args.get("prefix") or None,
     }
-    modellist = []
-    swlist = []
-    for row in result:
-        if "N/A" not in row[0]:
-            modellist.append(row[0])
-        if "N/A" not in row[1]:
-            swlist.append(row[1])
-        network["total"] += row[2]
-        network["up"] += row[3]
-        network["down"] += row[4]
-        network["disabled"] += row[5]
-        network["int10m"] += row[6]
-        network["int100m"] += row[7]
-        network["int1g"] += row[8]
-        network["int10g"] += row[9]
-        network["int25g"] += row[10]
-        network["int40g"] += row[11]
-        network["int100g"] += row[12]
-        network["copper"] += row[13]
-        network["sfp"] += row[14]
-        network["virtual"] += row[15]
+    if request.args.get("after"):
+        query["after"] = decodeCursor(request.args["after"])
+    return query
+
+
+def getNetworkWide():
+    """
+    Query DB for network-wide statistics,
+    which are totalled by the DB itself
+    """
+    swDB = getDB()
+    totals = swDB.getNetworkWideStats()
     # Get 5 most common models / software versions
-    network["models"] = Counter(modellist).most_common(5)
-    network["swvers"] = Counter(swlist).most_common(5)
-    return network
+    models = swDB.getMostCommon("model", 5)
+    swvers = swDB.getMostCommon("sw_ver", 5)
+    return totals, models, swvers
+
+
+def historySeries(rows, countname):
+    """
+    Convert port_history rows into a list of dicts,
+    one per point in the trend series
+    """
+    series = []
+    for row in rows:
+        point = {"time": row[0], countname: row[1]}
+        point.update(zip(switchdb.HISTORY_COLUMNS, row[2:]))
+        series.append(point)
+    return series
+
+
+def getSwitchHistory(serial, period, since):
+    """
+    Query DB for port count trends on one specific device
+    by serial number
+    """
+    swDB = getDB()
+    return historySeries(swDB.getSwitchHistory(serial, period, since), "samples")
+
+
+def getNetworkHistory(period, since):
+    """
+    Query DB for port count trends summed across all switches
+    """
+    swDB = getDB()
+    return historySeries(swDB.getNetworkHistory(period, since), "switches")
+
+
+def metricLabels(**labels):
+    """
+    Format Prometheus metric labels, escaping the values
+    """
+    pairs = []
+    for name, value in labels.items():
+        value = value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def metricHeader(name, kind, description):
+    """
+    HELP & TYPE lines which precede each metric
+    """
+    return [f"# HELP {name} {description}", f"# TYPE {name} {kind}"]
+
+
+def getCollectorMetrics():
+    """
+    Query DB for the latest sweep & per-device poll timings
+    """
+    swDB = getDB()
+    lines = []
+    sweeps = swDB.getSweepTimings(1)
+    if sweeps:
+        ts, duration, devices, succeeded = sweeps[0]
+        for name, kind, description, value in (
+            (
+                "switchport_sweep_duration_seconds",
+                "gauge",
+                "Duration of the last full collector sweep",
+                duration,
+            ),
+            (
+                "switchport_sweep_devices",
+                "gauge",
+                "Devices polled in the last full collector sweep",
+                devices,
+            ),
+            (
+                "switchport_sweep_succeeded_devices",
+                "gauge",
+                "Devices successfully polled in the last full collector sweep",
+                succeeded,
+            ),
+            (
+                "switchport_sweep_timestamp_seconds",
+                "gauge",
+                "Unix time the last full collector sweep finished",
+                ts,
+            ),
+        ):
+            lines += metricHeader(name, kind, description)
+            lines.append(f"{name} {value}")
+    timings = swDB.getDeviceTimings()
+    if timings:
+        name = "switchport_device_stage_seconds"
+        lines += metricHeader(
+            name, "gauge", "Time spent in each stage of a device's latest poll"
+        )
+        for row in timings:
+            for stage, value in zip(switchdb.TIMING_STAGES, row[3:]):
+                labels = metricLabels(device=row[0], ip=row[1], stage=stage)
+                lines.append(f"{name}{labels} {value}")
+        name = "switchport_device_poll_seconds"
+        lines += metricHeader(name, "gauge", "Total time of a device's latest poll")
+        for row in timings:
+            labels = metricLabels(device=row[0], ip=row[1])
+            lines.append(f"{name}{labels} {sum(row[3:])}")
+        name = "switchport_device_poll_timestamp_seconds"
+        lines += metricHeader(
+            name, "gauge", "Unix time a device's latest poll was recorded"
+        )
+        for row in timings:
+            labels = metricLabels(device=row[0], ip=row[1])
+            lines.append(f"{name}{labels} {row[2]}")
+    return lines
+
+
+def getRequestMetrics():
+    """
+    Format the dashboard's request latency histograms
+    """
+    name = "switchport_http_request_duration_seconds"
+    lines = metricHeader(name, "histogram", "Dashboard request latency")
+    with _latency_lock:
+        histograms = {key: list(values) for key, values in _latency.items()}
+    for (endpoint, method, status), values in sorted(histograms.items()):
+        labels = dict(endpoint=endpoint, method=method, status=status)
+        for bound, count in zip(LATENCY_BUCKETS, values):
+            bucket = metricLabels(**labels, le=str(bound))
+            lines.append(f"{name}_bucket{bucket} {count}")
+        bucket = metricLabels(**labels, le="+Inf")
+        lines.append(f"{name}_bucket{bucket} {values[-1]}")
+        lines.append(f"{name}_sum{metricLabels(**labels)} {values[-2]}")
+        lines.append(f"{name}_count{metricLabels(**labels)} {values[-1]}")
+    return lines
 
 
 def deleteDevice(serial):
     """
     Call to DB to delete a device by serial number
     """
-    swDB = switchdb.DB()
+    swDB = getDB()
     swDB.deleteBySerial(serial)
-    swDB.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,302 @@
+import os
+
+import pytest
+
+import buckets
+import data_collector
+import parsers
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+def fixture(name):
+    """
+    Read captured device output from tests/fixtures
+    """
+    with open(os.path.join(FIXTURES, name), "r") as capture:
+        return capture.read()
+
+
+# Expected results, in the structure (and key names) returned by Genie
+XE_INTERFACES = {
+    "Vlan1": {
+        "oper_status": "up",
+        "enabled": True,
+        "phys_address": "0057.d2b9.c6c7",
+        "bandwidth": 1000000,
+    },
+    "GigabitEthernet0/0": {
+        "oper_status": "up",
+        "enabled": True,
+        "phys_address": "0057.d2b9.c600",
+        "bandwidth": 1000000,
+        "duplex_mode": "full",
+        "port_speed": "1000mbps",
+        "media_type": "RJ45",
+    },
+    "GigabitEthernet1/0/1": {
+        "oper_status": "up",
+        "enabled": True,
+        "phys_address": "0057.d2b9.c681",
+        "description": "uplink to core-sw-01",
+        "bandwidth": 1000000,
+        "duplex_mode": "full",
+        "port_speed": "1000mb/s",
+        "media_type": "10/100/1000BaseTX",
+    },
+    "GigabitEthernet1/0/2": {
+        "oper_status": "down",
+        "enabled": True,
+        "phys_address": "0057.d2b9.c682",
+        "bandwidth": 1000000,
+        "duplex_mode": "auto",
+        "port_speed": "auto",
+        "media_type": "10/100/1000BaseTX",
+    },
+    "GigabitEthernet1/0/3": {
+        "oper_status": "down",
+        "enabled": False,
+        "phys_address": "0057.d2b9.c683",
+        "description": "spare - printer room",
+        "bandwidth": 1000000,
+        "duplex_mode": "auto",
+        "port_speed": "auto",
+        "media_type": "10/100/1000BaseTX",
+    },
+    "GigabitEthernet1/0/4": {
+        "oper_status": "up",
+        "enabled": True,
+        "phys_address": "0057.d2b9.c684",
+        "description": "phone 2201",
+        "bandwidth": 100000,
+        "duplex_mode": "full",
+        "port_speed": "100mb/s",
+        "media_type": "10/100/1000BaseTX",
+    },
+    "TenGigabitEthernet1/1/1": {
+        "oper_status": "up",
+        "enabled": True,
+        "phys_address": "0057.d2b9.c6a1",
+        "description": "dist-sw-02 Te1/1/1",
+        "bandwidth": 10000000,
+        "duplex_mode": "full",
+        "port_speed": "10gb/s",
+        "media_type": "SFP-10GBase-SR",
+    },
+    "TenGigabitEthernet1/1/2": {
+        "oper_status": "down",
+        "enabled": True,
+        "phys_address": "0057.d2b9.c6a2",
+        "bandwidth": 10000000,
+        "duplex_mode": "auto",
+        "port_speed": "auto",
+        "media_type": "unknown",
+    },
+}
+
+NX_INTERFACES = {
+    "mgmt0": {
+        "oper_status": "up",
+        "enabled": True,
+        "phys_address": "5254.0012.3400",
+        "bandwidth": 1000000,
+        "duplex_mode": "full",
+        "port_speed": "1000",
+        "port_speed_unit": "Mb/s",
+    },
+    "Ethernet1/1": {
+        "oper_status": "up",
+        "enabled": True,
+        "phys_address": "5254.0012.3456",
+        "description": "esx-01 vmnic0",
+        "bandwidth": 10000000,
+        "duplex_mode": "full",
+        "port_speed": "10",
+        "port_speed_unit": "Gb/s",
+        "media_type": "10G",
+    },
+    "Ethernet1/2": {
+        "oper_status": "down",
+        "enabled": True,
+        "phys_address": "5254.0012.3457",
+        "bandwidth": 10000000,
+        "duplex_mode": "auto",
+        "port_speed": "auto-speed",
+    },
+    "Ethernet1/3": {
+        "oper_status": "down",
+        "enabled": False,
+        "phys_address": "5254.0012.3458",
+        "description": "reserved",
+        "bandwidth": 25000000,
+        "duplex_mode": "auto",
+        "port_speed": "auto-speed",
+    },
+    "Vlan1": {
+        "oper_status": "down",
+        "enabled": False,
+        "phys_address": "5254.0012.3401",
+        "bandwidth": 1000000,
+    },
+}
+
+XE_VERSION = {
+    "version": {
+        "chassis": "C9300-48P",
+        "chassis_sn": "FOC2231X0AB",
+        "version": "17.3.4",
+        "xe_version": "17.03.04",
+    }
+}
+
+NX_VERSION = {
+    "platform": {
+        "hardware": {"model": "Nexus9000 C9300v", "processor_board_id": "9N3KD63KWT0"},
+        "software": {"system_version": "9.3(8)"},
+    }
+}
+
+
+def test_interfaces_xe():
+    assert parsers.parseInterfacesXE(fixture("iosxe_show_interfaces.txt")) == (
+        XE_INTERFACES
+    )
+
+
+def test_interfaces_xe_multigig():
+    # Media types such as 2.5G/5G contain dots, which used to cut them short
+    interfaces = parsers.parseInterfacesXE(
+        fixture("iosxe_show_interfaces_multigig.txt")
+    )
+    media = {name: iface["media_type"] for name, iface in interfaces.items()}
+    assert media == {
+        "TwoGigabitEthernet1/0/1": "100/1000/2.5G/5G/10GBaseTX",
+        "TwoGigabitEthernet1/0/2": "100/1000/2.5G/5G/10GBaseTX",
+        "TenGigabitEthernet1/0/3": "100/1000/2.5G/5G/10GBaseTX",
+    }
+    assert interfaces["TwoGigabitEthernet1/0/1"]["port_speed"] == "2500mb/s"
+    assert interfaces["TenGigabitEthernet1/0/3"]["port_speed"] == "5000mb/s"
+    for iface in interfaces.values():
+        assert buckets.mediaColumn(iface["media_type"]) == "intmedcop"
+    assert buckets.speedColumn(interfaces["TwoGigabitEthernet1/0/1"]["bandwidth"]) == (
+        "intop2_5g"
+    )
+    assert buckets.speedColumn(interfaces["TenGigabitEthernet1/0/3"]["bandwidth"]) == (
+        "intop5g"
+    )
+
+
+def test_media_nx_copper():
+    # NX-OS copper shows as e.g. 10Gbase-T in 'show interface status', but only
+    # as 'media type is 10G' in 'show interface'. Lean & full polls must agree
+    assert buckets.mediaColumn("10Gbase-T") == buckets.mediaColumn("10G")
+    assert buckets.mediaColumn("1000base-T") == buckets.mediaColumn("1G")
+    assert buckets.mediaColumn("10/100/1000BaseTX") == "intmedcop"
+
+
+def test_interfaces_nx():
+    assert parsers.parseInterfacesNX(fixture("nxos_show_interface.txt")) == (
+        NX_INTERFACES
+    )
+
+
+def test_interfaces_nx_json():
+    # The JSON capture has no SVIs, everything else matches the text output
+    expected = {
+        name: interface
+        for name, interface in NX_INTERFACES.items()
+        if not name.startswith("Vlan")
+    }
+    assert parsers.parseInterfacesNXJSON(fixture("nxos_show_interface.json")) == (
+        expected
+    )
+
+
+def test_has_json():
+    assert parsers.hasJSON(fixture("nxos_show_interface.json"))
+    assert not parsers.hasJSON("% Invalid command at '^' marker.\n")
+    # A brace in a description doesn't make text output JSON
+    text = fixture("nxos_show_interface.txt").replace("reserved", "{reserved}")
+    assert not parsers.hasJSON(text)
+
+
+@pytest.mark.parametrize(
+    "platform, full, status, description",
+    [
+        (
+            "iosxe",
+            "iosxe_show_interfaces.txt",
+            "iosxe_show_interfaces_status.txt",
+            "iosxe_show_interfaces_description.txt",
+        ),
+        (
+            "nxos",
+            "nxos_show_interface.txt",
+            "nxos_show_interface_status.txt",
+            "nxos_show_interface_description.txt",
+        ),
+    ],
+)
+def test_lean_matches_full(platform, full, status, description):
+    # Switching between lean & full polls mustn't change port counts or
+    # interface rows - apart from MAC addresses, which lean polls don't see
+    parse = {"iosxe": parsers.parseInterfacesXE, "nxos": parsers.parseInterfacesNX}
+    full_counts, full_interfaces = data_collector.tallyInterfaces(
+        parse[platform](fixture(full))
+    )
+    lean = parsers.parseInterfacesLean(
+        platform, fixture(status), fixture(description)
+    )
+    lean_counts, lean_interfaces = data_collector.tallyInterfaces(lean)
+    assert lean_counts == full_counts
+    assert [iface._replace(phys_address=None) for iface in full_interfaces] == (
+        lean_interfaces
+    )
+
+
+def test_lean_descriptions():
+    # 'show interfaces status' truncates names, the description command doesn't
+    lean = parsers.parseInterfacesLean(
+        "iosxe",
+        fixture("iosxe_show_interfaces_status.txt"),
+        fixture("iosxe_show_interfaces_description.txt"),
+    )
+    assert lean["GigabitEthernet1/0/1"]["description"] == "uplink to core-sw-01"
+    assert lean["GigabitEthernet1/0/3"]["enabled"] is False
+    assert "description" not in lean["GigabitEthernet1/0/2"]
+
+
+def test_version_xe():
+    assert parsers.parseVersionXE(fixture("iosxe_show_version.txt")) == XE_VERSION
+
+
+def test_version_nx():
+    assert parsers.parseVersionNX(fixture("nxos_show_version.txt")) == NX_VERSION
+
+
+def test_version_nx_json():
+    assert parsers.parseVersionNXJSON(fixture("nxos_show_version.json")) == (
+        NX_VERSION
+    )
+
+
+@pytest.mark.parametrize(
+    "parser",
+    [
+        parsers.parseInterfacesXE,
+        parsers.parseInterfacesNX,
+        parsers.parseInterfacesNXJSON,
+        parsers.parseVersionXE,
+        parsers.parseVersionNX,
+        parsers.parseVersionNXJSON,
+    ],
+)
+def test_unparseable_output(parser):
+    # Raised so that parseOutput() falls back to Genie
+    with pytest.raises(ValueError):
+        parser("% Invalid input detected at '^' marker.\n")
+
+
+def test_builtin_parser_selected():
+    output = fixture("iosxe_show_version.txt")
+    assert parsers.parseOutput("iosxe", "show version", output) == XE_VERSION